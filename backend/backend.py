@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, stream_with_context, g
 from flask_cors import CORS
 import requests
 import math
@@ -7,60 +7,458 @@ import overpy
 import time
 import urllib.parse
 import pandas as pd
+import numpy as np
 import os
+import json
+import gzip
+import threading
+import multiprocessing
+import atexit
+import functools
+import contextvars
+import cProfile
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from spatial_index import GridIndex
+from geo import haversine_np, point_segment_distances_np, simplify_polyline, encode_polyline, tile_bounds, clip_polyline
+from snapshot import read_snapshot, write_snapshot
+from dataset_manager import DatasetManager
+from http_client import HttpClient, CircuitOpenError
+from road_cache import RoadTileCache
+from road_graph import RoadGraph
+from road_scores import RoadScores
+from routing import SafeRouter, WALKING_SPEED_MS
+from route_cache import RouteCache
+from tile_cache import Tile
+from versioned_cache import VersionedCache
+from metrics import Registry
+from request_profiles import ProfileStore
+
+try:
+    import brotli  # Optional: br responses for clients that accept them, gzip otherwise
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 overpass_api = overpy.Overpass()
 
-# Cache for API data
-POLICE_DATA_CACHE = None
-CCTV_DATA_CACHE = None
-MRT_DATA_CACHE = None
-ROBBERY_DATA_CACHE = None
-API_CACHE_TIME = {}
-API_CACHE_DURATION = 1800  # Cache for 30 minutes
+# Prometheus metrics, served in the text exposition format at /metrics
+METRICS = Registry()
+REQUEST_LATENCY = METRICS.histogram('backend_request_duration_seconds',
+                                    'Request latency per endpoint (until the last line for streamed responses)',
+                                    ('endpoint', 'method'))
+REQUESTS_TOTAL = METRICS.counter('backend_requests_total', 'Requests per endpoint and status code',
+                                 ('endpoint', 'method', 'status'))
+STAGE_LATENCY = METRICS.histogram('backend_stage_duration_seconds', 'Time spent in each processing stage', ('stage',))
+SCORED_POINTS = METRICS.counter('backend_scored_points_total', 'Points counted against the safety layers per stage',
+                                ('stage',))
+UPSTREAM_LATENCY = METRICS.histogram('backend_upstream_request_duration_seconds', 'Outbound call latency per upstream',
+                                     ('upstream',))
+UPSTREAM_REQUESTS = METRICS.counter('backend_upstream_requests_total', 'Outbound calls per upstream', ('upstream',))
+UPSTREAM_ERRORS = METRICS.counter('backend_upstream_errors_total',
+                                  'Failed outbound calls per upstream: timeout, connection, circuit_open, error or http_<status>',
+                                  ('upstream', 'kind'))
 
-def load_police_data():
-    """Load police station data from local ODS file"""
-    global POLICE_DATA_CACHE
-    if POLICE_DATA_CACHE is not None:
-        return POLICE_DATA_CACHE
-    
-    try:
-        # Read ODS file
-        df = pd.read_excel('police.ods', engine='odf')
+# Stage spans of the current request, returned in its Server-Timing header
+REQUEST_SPANS = contextvars.ContextVar('request_spans', default=None)
+
+# On-demand cProfile of single requests: `?profile=1` with an X-Profile-Token header matching
+# PROFILE_TOKEN (empty disables profiling). Results are downloaded from /profiles/<id>.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_MAX_ENTRIES = int(os.environ.get('PROFILE_MAX_ENTRIES', 20))
+PROFILES = ProfileStore(max_entries=PROFILE_MAX_ENTRIES)
+PROFILE_LOCK = threading.Lock()  # One profiled request at a time
+
+def profile_authorized():
+    token = request.headers.get('X-Profile-Token', '')
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode('utf-8'), PROFILE_TOKEN.encode('utf-8'))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    REQUEST_SPANS.set([])
+    if request.args.get('profile') == '1' and profile_authorized() and PROFILE_LOCK.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.after_request
+def add_server_timing(response):
+    # Registered before compress_response, so it runs after it and the profile includes compression
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        PROFILE_LOCK.release()
+        profile_id = PROFILES.add(profiler, f"{request.method} {request.full_path.rstrip('?')}")
+        response.headers['X-Profile-Id'] = profile_id
+        response.headers['X-Profile-Url'] = f"/profiles/{profile_id}"
+    # Stages are summed per name; stages run in parallel threads can add up to more than total
+    totals = {}
+    for name, seconds in REQUEST_SPANS.get() or ():
+        total, calls = totals.get(name, (0.0, 0))
+        totals[name] = (total + seconds, calls + 1)
+    entries = [f'{name};dur={total * 1000:.1f}' + (f';desc="{calls} calls"' if calls > 1 else '')
+               for name, (total, calls) in totals.items()]
+    start = g.get('request_start')
+    if start is not None:
+        entries.append(f'total;dur={(time.perf_counter() - start) * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(entries)
+    response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+@app.teardown_request
+def record_request_metrics(error=None):
+    # Runs once the response is done, i.e. after the last line of a streamed response
+    REQUEST_SPANS.set(None)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # The request failed before after_request ran
+        profiler.disable()
+        PROFILE_LOCK.release()
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    status = 500 if error is not None else g.pop('response_status', 500)
+    REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+    REQUESTS_TOTAL.inc(endpoint=endpoint, method=request.method, status=status)
+
+def record_stage(name, seconds, points=None):
+    STAGE_LATENCY.observe(seconds, stage=name)
+    if points is not None:
+        SCORED_POINTS.inc(points, stage=name)
+    spans = REQUEST_SPANS.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+def in_request_context(func):
+    """func bound to a copy of the caller's context, so stages it records in a pool thread count for this request"""
+    return functools.partial(contextvars.copy_context().run, func)
+
+def timed_stage(name, points_arg=None):
+    """
+    Decorator recording every call's duration as processing stage `name`; with points_arg,
+    the length of that positional argument is also counted as scored points.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - start,
+                             len(args[points_arg]) if points_arg is not None else None)
+        return wrapper
+    return decorator
+
+# JSON bodies at least this large are compressed for clients that accept gzip/br (0 disables it)
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+
+def accepted_encodings():
+    """Content codings the client accepts (q=0 excluded)"""
+    encodings = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        if name.strip():
+            encodings.add(name.strip().lower())
+    return encodings
+
+def negotiate_compression():
+    """(content coding, compress function) for the client's Accept-Encoding, or None"""
+    encodings = accepted_encodings()
+    if brotli is not None and 'br' in encodings:
+        return 'br', lambda body: brotli.compress(body, quality=5)
+    if 'gzip' in encodings:
+        return 'gzip', lambda body: gzip.compress(body, compresslevel=6)
+    return None
+
+@app.after_request
+def compress_response(response):
+    if (COMPRESS_MIN_BYTES <= 0 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    compression = negotiate_compression()
+    if compression is None:
+        return response
+    coding, compress = compression
+    response.set_data(compress(body))
+    response.headers['Content-Encoding'] = coding
+    response.vary.add('Accept-Encoding')
+    return response
+
+OVERPASS_URL = os.environ.get('OVERPASS_URL', overpy.Overpass.default_url)
+
+# Upstream host -> name used in the upstream metrics
+UPSTREAM_NAMES = {
+    'data.taipei': 'data_taipei',
+    'tppkl.blob.core.windows.net': 'blob_storage',
+    'api.nlsc.gov.tw': 'nlsc',
+    'router.project-osrm.org': 'osrm',
+    urllib.parse.urlsplit(OVERPASS_URL).netloc: 'overpass',
+}
+
+def record_upstream_call(url, seconds, status_code, error):
+    upstream = UPSTREAM_NAMES.get(urllib.parse.urlsplit(url).netloc, 'other')
+    UPSTREAM_REQUESTS.inc(upstream=upstream)
+    if isinstance(error, CircuitOpenError):
+        UPSTREAM_ERRORS.inc(upstream=upstream, kind='circuit_open')
+        return
+    UPSTREAM_LATENCY.observe(seconds, upstream=upstream)
+    if isinstance(error, requests.Timeout):
+        UPSTREAM_ERRORS.inc(upstream=upstream, kind='timeout')
+    elif isinstance(error, requests.ConnectionError):
+        UPSTREAM_ERRORS.inc(upstream=upstream, kind='connection')
+    elif error is not None:
+        UPSTREAM_ERRORS.inc(upstream=upstream, kind='error')
+    elif status_code >= 400:
+        UPSTREAM_ERRORS.inc(upstream=upstream, kind=f'http_{status_code}')
+
+# Shared keep-alive client for every outbound call (data.taipei, blob storage, NLSC, OSRM, Overpass)
+http_client = HttpClient(on_request=record_upstream_call)
+
+# Refresh interval of the data.taipei datasets (stale data is served while refreshing)
+API_CACHE_DURATION = 1800  # 30 minutes
+
+# data.taipei resource ids
+CCTV_RESOURCE_ID = "d317a3c4-ff08-48af-894e-31dfb5155de3"
+MRT_RESOURCE_ID = "307a7f61-e302-4108-a817-877ccbfca7c1"
+ROBBERY_RESOURCE_ID = "6ecb4c41-fbc9-4b04-b182-a7da6c780f8d"
+
+SAFETY_FEATURE_TYPES = ('cctv', 'metro', 'robbery_incident', 'streetlight', 'police')
+
+GRID_CELL_SIZE_M = 200  # Cell size of the per-layer grid index
+
+SAFETY_DATA_VERSION = 0  # Bumped on every layer swap, derived caches compare against it
+SAFETY_DATA_VERSION_LOCK = threading.Lock()  # Layers of different datasets are swapped from different loader threads
+
+# Feature type -> (resource id, latitude key, longitude key, required name key)
+# for the data.taipei layers
+API_LAYER_FIELDS = {
+    "cctv": (CCTV_RESOURCE_ID, 'wgsy', 'wgsx', '攝影機編號'),
+    "metro": (MRT_RESOURCE_ID, '緯度', '經度', '出入口名稱'),
+    "robbery_incident": (ROBBERY_RESOURCE_ID, '緯度', '經度', None),
+}
+
+class SafetyLayer:
+    """
+    One safety dataset stored column-wise: contiguous float64 lat/lng arrays, a compact
+    id column and a grid index. Per-record metadata (records) is only looked up for hits.
+    """
+
+    def __init__(self, lats, lngs, ids=None, records=None, index=None):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        # ids default to the row position (used to look up records)
+        self.ids = np.arange(len(self.lats), dtype=np.int32) if ids is None else np.asarray(ids)
+        self.records = records
+        self.index = index if index is not None else GridIndex(self.lats, self.lngs, cell_size_m=GRID_CELL_SIZE_M)
+
+    def indices_in_bbox(self, south, west, north, east):
+        """Return sorted indices of the points inside the bbox"""
+        idx = self.index.candidates(south, west, north, east)
+        lats = self.lats[idx]
+        lngs = self.lngs[idx]
+        mask = (lats >= south) & (lats <= north) & (lngs >= west) & (lngs <= east)
+        return np.sort(idx[mask])
+
+    def _radius_hits(self, center_lat, center_lng, radius_m):
+        """Return (indices, distances) arrays of the points within radius_m, in dataset order"""
+        idx = self.indices_in_bbox(*calculate_bbox(center_lat, center_lng, radius_m))
+        distances = haversine_np(center_lat, center_lng, self.lats[idx], self.lngs[idx])
+        mask = distances <= radius_m
+        return idx[mask], distances[mask]
+
+    def query_radius(self, center_lat, center_lng, radius_m):
+        """Return (index, distance) pairs within radius_m, in dataset order"""
+        idx, distances = self._radius_hits(center_lat, center_lng, radius_m)
+        return list(zip(idx.tolist(), distances.tolist()))
+
+    def nearest_in_radius(self, center_lat, center_lng, radius_m, k):
+        """
+        Return (hit count, k nearest (index, distance) pairs) within radius_m.
+        Only the k nearest hits are sorted; ties on the rounded distance keep dataset order.
+        """
+        idx, distances = self._radius_hits(center_lat, center_lng, radius_m)
+        count = len(idx)
+        rounded = np.round(distances)
+        if count > k:
+            # Everything up to the k-th smallest rounded distance, ties included
+            kth = np.partition(rounded, k - 1)[k - 1]
+            keep = rounded <= kth
+            idx, distances, rounded = idx[keep], distances[keep], rounded[keep]
+        order = np.lexsort((idx, rounded))[:k]
+        return count, list(zip(idx[order].tolist(), distances[order].tolist()))
+
+    def nearest(self, center_lat, center_lng, k=1, max_distance_m=None, start_radius_m=GRID_CELL_SIZE_M):
+        """
+        k-nearest-neighbour query: return up to k (index, distance) pairs sorted by distance.
+        The search radius doubles from start_radius_m until it holds k points (or
+        max_distance_m / the whole layer is covered), so the k found are the true nearest.
+        """
+        if len(self) == 0 or k <= 0:
+            return []
+        # Once the radius reaches this every point of the layer is inside it
+        extent_m = 1.01 * max(haversine(center_lat, center_lng, lat, lng) for lat, lng in (
+            (self.lats.min(), self.lngs.min()), (self.lats.min(), self.lngs.max()),
+            (self.lats.max(), self.lngs.min()), (self.lats.max(), self.lngs.max())))
+        radius_m = start_radius_m
+        while True:
+            if max_distance_m is not None:
+                radius_m = min(radius_m, max_distance_m)
+            idx, distances = self._radius_hits(center_lat, center_lng, radius_m)
+            if len(idx) >= k or radius_m >= extent_m or radius_m == max_distance_m:
+                order = np.argsort(distances, kind='stable')[:k]
+                return list(zip(idx[order].tolist(), distances[order].tolist()))
+            radius_m *= 2
+
+    def count_in_radius_batch(self, lats, lngs, radius_m, chunk_size=64):
+        """
+        Count the points within radius_m of each query point, without building any
+        per-feature objects. Query points are grouped into small spatial chunks and
+        each chunk is compared against the layer points in its bbox in one array op.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        counts = np.zeros(len(lats), dtype=np.int64)
+        if len(self) == 0 or len(lats) == 0:
+            return counts
         
-        # Convert to list of dicts and cache
-        POLICE_DATA_CACHE = df.to_dict('records')
-        print(f"Loaded {len(POLICE_DATA_CACHE)} police stations from local file")
-        return POLICE_DATA_CACHE
-    except Exception as e:
-        print(f"Error loading police data from ODS: {e}")
-        return []
+        # Group query points by coarse blocks (4x4 index cells) so every chunk covers a small area
+        block_deg = self.index.cell_deg * 4
+        rows = np.floor(lats / block_deg)
+        cols = np.floor(lngs / block_deg)
+        order = np.lexsort((cols, rows))
+        block_starts = np.flatnonzero(np.diff(rows[order]) != 0) + 1
+        block_starts = np.union1d(block_starts, np.flatnonzero(np.diff(cols[order]) != 0) + 1)
+        bounds = np.concatenate(([0], block_starts, [len(order)])).astype(int)
+        
+        lat_offset = (radius_m / 6371000) * (180 / math.pi)
+        chunks = (order[start:min(end, start + chunk_size)]
+                  for block_start, end in zip(bounds[:-1], bounds[1:])
+                  for start in range(block_start, end, chunk_size))
+        for chunk in chunks:
+            chunk_lats = lats[chunk]
+            chunk_lngs = lngs[chunk]
+            lng_offset = lat_offset / math.cos(math.radians(np.abs(chunk_lats).max()))
+            idx = self.indices_in_bbox(chunk_lats.min() - lat_offset, chunk_lngs.min() - lng_offset,
+                                       chunk_lats.max() + lat_offset, chunk_lngs.max() + lng_offset)
+            if len(idx) == 0:
+                continue
+            distances = haversine_np(chunk_lats[:, None], chunk_lngs[:, None],
+                                     self.lats[idx][None, :], self.lngs[idx][None, :])
+            counts[chunk] = (distances <= radius_m).sum(axis=1)
+        return counts
 
-def fetch_api_data_cached(resource_id, cache_name, limit=1000, offset=0):
-    """Fetch API data with caching"""
-    global API_CACHE_TIME
-    
-    # Check cache
-    cache_var = globals().get(cache_name)
-    if cache_var is not None and cache_name in API_CACHE_TIME:
-        cache_age = time.time() - API_CACHE_TIME[cache_name]
-        if cache_age < API_CACHE_DURATION:
-            print(f"Using cached {cache_name} ({len(cache_var)} items, age: {int(cache_age)}s)")
-            return cache_var
-    
-    # Fetch fresh data
-    print(f"Fetching {cache_name} from API...")
-    data = fetch_api_data(resource_id, limit, offset)
-    
-    # Update cache
-    globals()[cache_name] = data
-    API_CACHE_TIME[cache_name] = time.time()
-    print(f"Cached {cache_name}: {len(data)} items")
-    
-    return data
+    def count_along_polyline(self, lats, lngs, radius_m, chunk_size=16):
+        """
+        Count the points within radius_m of a polyline per polyline edge (len(lats) - 1
+        counts). Every point is assigned to its nearest edge, so each one is counted once.
+        Edges are taken in runs of chunk_size; each run only looks at the points in its own
+        bbox expanded by radius_m, and a point seen by several runs keeps its closest edge.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        edge_count = max(len(lats) - 1, 0)
+        counts = np.zeros(edge_count, dtype=np.int64)
+        if len(self) == 0 or edge_count == 0:
+            return counts
+
+        lat_offset = (radius_m / 6371000) * (180 / math.pi)
+        # One projection for the whole polyline so distances from different runs compare exactly
+        ref_lat = lats.mean()
+        hit_idx, hit_dist, hit_edge = [], [], []
+        for start in range(0, edge_count, chunk_size):
+            end = min(start + chunk_size, edge_count)
+            run_lats = lats[start:end + 1]
+            run_lngs = lngs[start:end + 1]
+            lng_offset = lat_offset / math.cos(math.radians(np.abs(run_lats).max()))
+            idx = self.indices_in_bbox(run_lats.min() - lat_offset, run_lngs.min() - lng_offset,
+                                       run_lats.max() + lat_offset, run_lngs.max() + lng_offset)
+            if len(idx) == 0:
+                continue
+            distances = point_segment_distances_np(self.lats[idx], self.lngs[idx],
+                                                   run_lats[:-1], run_lngs[:-1], run_lats[1:], run_lngs[1:], ref_lat)
+            nearest = distances.argmin(axis=1)
+            nearest_dist = distances[np.arange(len(idx)), nearest]
+            keep = nearest_dist <= radius_m
+            hit_idx.append(idx[keep])
+            hit_dist.append(nearest_dist[keep])
+            hit_edge.append(nearest[keep] + start)
+        if not hit_idx:
+            return counts
+
+        # Closest edge per point over all runs (ties go to the earlier edge)
+        idx = np.concatenate(hit_idx)
+        dist = np.concatenate(hit_dist)
+        edge = np.concatenate(hit_edge)
+        order = np.lexsort((edge, dist, idx))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = idx[order][1:] != idx[order][:-1]
+        return np.bincount(edge[order][first], minlength=edge_count)
+
+    def record(self, idx):
+        return self.records[self.ids[idx]]
+
+    def __len__(self):
+        return len(self.lats)
+
+def on_safety_layer_update(feature_type, layer):
+    """Called by a dataset manager after it swapped in a new layer: marks derived data stale"""
+    global SAFETY_DATA_VERSION
+    with SAFETY_DATA_VERSION_LOCK:
+        SAFETY_DATA_VERSION += 1
+
+def build_safety_layer(items, lat_key, lng_key, name_key=None):
+    """Parse coordinates of a WGS84 dataset once and index it, skipping invalid entries"""
+    records, lats, lngs = [], [], []
+    for item in items:
+        try:
+            lat = float(item[lat_key])
+            lng = float(item[lng_key])
+        except (KeyError, ValueError, TypeError):
+            continue
+        if name_key is not None and name_key not in item:
+            continue
+        records.append(item)
+        lats.append(lat)
+        lngs.append(lng)
+    return SafetyLayer(lats, lngs, records=records)
+
+def load_police_layer():
+    """Load police station data from the local ODS file"""
+    df = pd.read_excel('police.ods', engine='odf')
+    records = df.to_dict('records')
+    print(f"Loaded {len(records)} police stations from local file")
+    
+    # Police data has TWD97 coordinates (POINT_X, POINT_Y), convert them once here
+    if 'POINT_X' in df.columns and 'POINT_Y' in df.columns:
+        point_x = pd.to_numeric(df['POINT_X'], errors='coerce').to_numpy(dtype=np.float64)
+        point_y = pd.to_numeric(df['POINT_Y'], errors='coerce').to_numpy(dtype=np.float64)
+    else:
+        point_x = point_y = np.full(len(df), np.nan)
+    valid = np.isfinite(point_x) & np.isfinite(point_y)
+    lats, lngs = twd97_to_wgs84_array(point_x[valid], point_y[valid])
+    records = [item for item, ok in zip(records, valid) if ok]
+    return SafetyLayer(lats, lngs, records=records)
+
+def load_api_layer(feature_type):
+    """Fetch one data.taipei dataset and build its layer"""
+    resource_id, lat_key, lng_key, name_key = API_LAYER_FIELDS[feature_type]
+    print(f"Fetching {feature_type} data from API...")
+    data = fetch_api_data(resource_id)
+    return build_safety_layer(data, lat_key, lng_key, name_key)
 
 # Haversine formula to calculate distance between two points in meters
 def haversine(lat1, lon1, lat2, lon2):
@@ -112,19 +510,57 @@ def calculate_safety_score(cctv_count, lamp_count, mrt_count, police_count, thef
     clamped_score = clamp(raw_score, 0.0, 1.0)
     return round(clamped_score * 100, 2)
 
-# Function to fetch data from a given resource_id
-def fetch_api_data(resource_id, limit=1000, offset=0):
+def calculate_safety_score_array(cctv_count, lamp_count, mrt_count, police_count, robbery_count,
+                                 cctv_max=5, lamp_max=10, mrt_max=3, police_max=1, robbery_ref=2):
+    """Vectorized calculate_safety_score for count arrays (no theft/store data, as in the endpoints)"""
+    C = np.clip(np.asarray(cctv_count) / cctv_max, 0.0, 1.0)
+    L = np.clip(np.asarray(lamp_count) / lamp_max, 0.0, 1.0)
+    P = np.clip(np.asarray(police_count) / police_max, 0.0, 1.0)
+    M = np.clip(np.asarray(mrt_count) / mrt_max, 0.0, 1.0)
+    Rr = np.clip(np.asarray(robbery_count) / robbery_ref, 0.0, 1.0)
+    
+    raw_score = 0.1*C + 0.5*L + 0.8*P + 0.7*M - 0.5*Rr
+    return np.round(np.clip(raw_score, 0.0, 1.0) * 100, 2)
+
+# data.taipei paging: rows per request and how many pages are fetched at once
+DATA_TAIPEI_PAGE_SIZE = 1000
+DATA_TAIPEI_MAX_WORKERS = int(os.environ.get('DATA_TAIPEI_MAX_WORKERS', 8))
+
+# Function to fetch one page of a data.taipei dataset (returns the API's result object)
+def fetch_api_page(resource_id, limit=DATA_TAIPEI_PAGE_SIZE, offset=0):
     api_url = "https://data.taipei/api/v1/dataset/" + resource_id + "?scope=resourceAquire"
     params = {
         "resource_id": resource_id,
         "limit": limit,
         "offset": offset
     }
-    response = requests.get(api_url, params=params)
+    response = http_client.get(api_url, params=params)
     if response.status_code != 200:
         raise Exception("Failed to fetch API data for resource_id: " + resource_id)
     data = response.json()
-    return data.get('result', {}).get('results', [])
+    return data.get('result', {})
+
+# Function to fetch every row of a data.taipei dataset.
+# The first page reports the total count; the remaining pages are fetched concurrently
+# and concatenated in offset order. Any failed page fails the whole fetch.
+def fetch_api_data(resource_id, page_size=DATA_TAIPEI_PAGE_SIZE, max_workers=DATA_TAIPEI_MAX_WORKERS):
+    start = time.time()
+    first = fetch_api_page(resource_id, page_size, 0)
+    results = list(first.get('results', []))
+    try:
+        total = int(first.get('count', len(results)))
+    except (TypeError, ValueError):
+        total = len(results)
+    
+    offsets = list(range(page_size, total, page_size)) if len(results) >= page_size else []
+    if offsets:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(offsets)))) as pool:
+            pages = pool.map(lambda offset: fetch_api_page(resource_id, page_size, offset).get('results', []), offsets)
+            for page in pages:
+                results.extend(page)
+    
+    print(f"Fetched {len(results)}/{total} rows of {resource_id} in {len(offsets) + 1} pages ({time.time() - start:.2f}s)")
+    return results
 
 # Function to convert TWD97 to WGS84 (simplified conversion for Taipei area)
 def twd97_to_wgs84(x, y):
@@ -169,61 +605,86 @@ def twd97_to_wgs84(x, y):
     
     return math.degrees(lat), math.degrees(lon)
 
+# Array version of twd97_to_wgs84 for dataset ingestion: x and y are array-likes of
+# the same shape, returns (lat, lng) float64 arrays. Same formula as the scalar one.
+def twd97_to_wgs84_array(x, y):
+    a = 6378137.0
+    b = 6356752.314245
+    lon0 = math.radians(121)
+    k0 = 0.9999
+    dx = 250000
+    
+    # Constants of the projection only need computing once per batch
+    e = math.sqrt(1 - (b**2 / a**2))
+    e2 = e**2 / (1 - e**2)
+    e1 = (1 - math.sqrt(1 - e**2)) / (1 + math.sqrt(1 - e**2))
+    
+    x = np.asarray(x, dtype=np.float64) - dx
+    y = np.asarray(y, dtype=np.float64)
+    
+    M = y / k0
+    mu = M / (a * (1 - e**2/4 - 3*e**4/64 - 5*e**6/256))
+    
+    phi1 = mu + (3*e1/2 - 27*e1**3/32) * np.sin(2*mu) + \
+           (21*e1**2/16 - 55*e1**4/32) * np.sin(4*mu) + \
+           (151*e1**3/96) * np.sin(6*mu)
+    
+    sin_phi1 = np.sin(phi1)
+    cos_phi1 = np.cos(phi1)
+    tan_phi1 = np.tan(phi1)
+    C1 = e2 * cos_phi1**2
+    T1 = tan_phi1**2
+    N1 = a / np.sqrt(1 - e**2 * sin_phi1**2)
+    R1 = a * (1 - e**2) / ((1 - e**2 * sin_phi1**2)**1.5)
+    D = x / (N1 * k0)
+    
+    lat = phi1 - (N1 * tan_phi1 / R1) * \
+          (D**2/2 - (5 + 3*T1 + 10*C1 - 4*C1**2 - 9*e2) * D**4/24 + \
+           (61 + 90*T1 + 298*C1 + 45*T1**2 - 252*e2 - 3*C1**2) * D**6/720)
+    
+    lon = lon0 + (D - (1 + 2*T1 + C1) * D**3/6 + \
+                  (5 - 2*C1 + 28*T1 - 3*C1**2 + 8*e2 + 24*T1**2) * D**5/120) / cos_phi1
+    
+    return np.degrees(lat), np.degrees(lon)
+
 # Function to geocode address to lat/lng using Taiwan government geocoding service
-def geocode_address(address, max_retries=3):
+def geocode_address(address):
     """Convert address to latitude and longitude using Taiwan MOI geocoding service"""
-    for attempt in range(max_retries):
-        try:
-            # Use Taiwan MOI Address Geocoding Service
-            url = "https://api.nlsc.gov.tw/other/TownVillagePointQuery/"
-            params = {
-                'address': address,
-                'format': 'json'
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data and len(data) > 0:
-                    # MOI service returns TWD97 coordinates, need to convert
-                    x = float(data[0].get('x', 0))
-                    y = float(data[0].get('y', 0))
-                    if x > 0 and y > 0:
-                        lat, lng = twd97_to_wgs84(x, y)
-                        return lat, lng
-            
-            return None, None
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(0.5)  # Wait before retry
-                continue
-            print(f"Geocoding failed for address: {address}, error: {e}")
-            return None, None
-    return None, None
-
-# Cache for streetlight data
-STREETLIGHT_DATA_CACHE = None
-STREETLIGHT_CACHE_TIME = None
-STREETLIGHT_CACHE_DURATION = 3600  # Cache for 1 hour
-
-# Function to fetch streetlight data from blob storage
-def fetch_streetlight_data():
-    global STREETLIGHT_DATA_CACHE, STREETLIGHT_CACHE_TIME
-    
-    # Check if cache is valid
-    if STREETLIGHT_DATA_CACHE is not None and STREETLIGHT_CACHE_TIME is not None:
-        cache_age = time.time() - STREETLIGHT_CACHE_TIME
-        if cache_age < STREETLIGHT_CACHE_DURATION:
-            print(f"Using cached streetlight data ({len(STREETLIGHT_DATA_CACHE)} items, age: {int(cache_age)}s)")
-            return STREETLIGHT_DATA_CACHE
-    
+    try:
+        # Use Taiwan MOI Address Geocoding Service
+        url = "https://api.nlsc.gov.tw/other/TownVillagePointQuery/"
+        params = {
+            'address': address,
+            'format': 'json'
+        }
+        
+        response = http_client.get(url, params=params, timeout=10)
+        
+        if response.status_code == 200:
+            data = response.json()
+            if data and len(data) > 0:
+                # MOI service returns TWD97 coordinates, need to convert
+                x = float(data[0].get('x', 0))
+                y = float(data[0].get('y', 0))
+                if x > 0 and y > 0:
+                    lat, lng = twd97_to_wgs84(x, y)
+                    return lat, lng
+        
+        return None, None
+    except Exception as e:
+        print(f"Geocoding failed for address: {address}, error: {e}")
+        return None, None
+
+STREETLIGHT_CACHE_DURATION = 3600  # Refresh streetlight data after 1 hour
+
+# Function to fetch streetlight data from blob storage (returns a columnar SafetyLayer)
+def load_streetlight_layer():
     print("Fetching streetlight data from Azure Blob Storage...")
     url = "https://tppkl.blob.core.windows.net/blobfs/TaipeiLight.json"
     
     try:
         # Add timeout to prevent hanging
-        response = requests.get(url, timeout=30)
+        response = http_client.get(url, timeout=30)
         if response.status_code != 200:
             raise Exception(f"Failed to fetch streetlight data: HTTP {response.status_code}")
         
@@ -231,34 +692,19 @@ def fetch_streetlight_data():
         raw_data = response.json()
         print(f"Converting {len(raw_data)} streetlight coordinates...")
         
-        # Convert TWD97 coordinates to WGS84
-
-
+        # Convert TWD97 coordinates to WGS84 in one batch straight into columns; only the
+        # lamp serial number is kept per record instead of a copy of every raw dict.
+        # Entries with missing or non-numeric coordinates become NaN and are dropped.
+        twd97_x = pd.to_numeric(pd.Series([item.get('TWD97X') for item in raw_data], dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        twd97_y = pd.to_numeric(pd.Series([item.get('TWD97Y') for item in raw_data], dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        valid = np.isfinite(twd97_x) & np.isfinite(twd97_y)
+        lats, lngs = twd97_to_wgs84_array(twd97_x[valid], twd97_y[valid])
+        serials = np.array([str(item.get('SerialNumber', 'Unknown')) for item, ok in zip(raw_data, valid) if ok])
+        del raw_data
         
-        converted_data = []
-        for idx, item in enumerate(raw_data):
-            if idx % 10000 == 0 and idx > 0:
-                print(f"  Converted {idx}/{len(raw_data)} streetlights...")
-            
-            try:
-                twd97_x = float(item['TWD97X'])
-                twd97_y = float(item['TWD97Y'])
-                lat, lng = twd97_to_wgs84(twd97_x, twd97_y)
-                
-                converted_item = item.copy()
-                converted_item['緯度'] = lat
-                converted_item['經度'] = lng
-                converted_item['燈號'] = item.get('SerialNumber', 'Unknown')
-                converted_data.append(converted_item)
-            except (KeyError, ValueError):
-                continue
-        
-        # Cache the result
-        STREETLIGHT_DATA_CACHE = converted_data
-        STREETLIGHT_CACHE_TIME = time.time()
-        print(f"Streetlight data cached: {len(converted_data)} items")
-        
-        return converted_data
+        layer = SafetyLayer(lats, lngs, ids=serials)
+        print(f"Streetlight data loaded: {len(layer)} items")
+        return layer
     
     except requests.Timeout:
         print("ERROR: Streetlight data fetch timed out after 30 seconds")
@@ -267,166 +713,246 @@ def fetch_streetlight_data():
         print(f"ERROR: Failed to fetch streetlight data: {str(e)}")
         raise
 
-# API endpoint to fetch CCTV, MRT and robbery incident data and transform it
-@app.route('/get_safety_data', methods=['GET'])
-def get_safety_data():
-    # Get parameters from query string
-    at = request.args.get('at', '2025-11-08T23:00:00+08:00')  # Default to example
-    center_lat = float(request.args.get('center_lat', 25.033964))
-    center_lng = float(request.args.get('center_lng', 121.564468))
-    radius_m = int(request.args.get('radius_m', 200))
-    tz = request.args.get('tz', 'Asia/Taipei')
+# One manager per safety dataset. Each holds the current (immutable) layer, serves it while
+# a single background thread rebuilds it once it is older than the TTL, and collapses
+# concurrent first loads into one. The police file is local and only loaded once.
+SAFETY_DATASETS = {
+    feature_type: DatasetManager(feature_type, lambda feature_type=feature_type: load_api_layer(feature_type),
+                                 ttl=API_CACHE_DURATION, on_update=on_safety_layer_update)
+    for feature_type in API_LAYER_FIELDS
+}
+SAFETY_DATASETS['streetlight'] = DatasetManager('streetlight', load_streetlight_layer,
+                                                ttl=STREETLIGHT_CACHE_DURATION, on_update=on_safety_layer_update)
+SAFETY_DATASETS['police'] = DatasetManager('police', load_police_layer, on_update=on_safety_layer_update)
 
-    places = []
+# On-disk snapshot of the converted layers for fast warm restarts (empty path disables it)
+SAFETY_SNAPSHOT_PATH = os.environ.get('SAFETY_SNAPSHOT_PATH', 'snapshot/safety_layers.snap')
+SAFETY_SNAPSHOT_MAX_AGE = int(os.environ.get('SAFETY_SNAPSHOT_MAX_AGE', 86400))  # Use snapshots up to 1 day old
+SNAPSHOT_LOCK = threading.Lock()
+SNAPSHOT_CHECKED = False
+SNAPSHOT_SAVING = False
+SNAPSHOT_SAVED_VERSION = None
 
-    # Fetch and process CCTV data (with caching)
-    try:
-        cctv_results = fetch_api_data_cached("d317a3c4-ff08-48af-894e-31dfb5155de3", "CCTV_DATA_CACHE")
-        for item in cctv_results:
-            try:
-                lat = float(item['wgsy'])
-                lng = float(item['wgsx'])
-                distance = haversine(center_lat, center_lng, lat, lng)
-                if distance <= radius_m:
-                    places.append({
-                        "safety": 1,
-                        "type": "cctv",
-                        "name": item['攝影機編號'],
-                        "location": {"lat": lat, "lng": lng},
-                        "distance_m": round(distance),
-                        "phone": item.get('電話', '')
-                    })
-            except (KeyError, ValueError):
-                continue  # Skip invalid entries
-    except Exception as e:
-        print(f"Error fetching CCTV data: {e}")
+def save_safety_snapshot(layers):
+    """Write every layer (coordinates, ids, grid index and records) to the snapshot file"""
+    arrays = {}
+    blobs = {}
+    meta = {"layers": {}}
+    for feature_type, layer in layers.items():
+        arrays[f"{feature_type}.lats"] = layer.lats
+        arrays[f"{feature_type}.lngs"] = layer.lngs
+        arrays[f"{feature_type}.ids"] = layer.ids
+        arrays[f"{feature_type}.index_order"] = layer.index.order
+        arrays[f"{feature_type}.index_keys"] = layer.index.keys
+        if layer.records is not None:
+            blobs[f"{feature_type}.records"] = json.dumps(layer.records, ensure_ascii=False, default=str).encode('utf-8')
+        meta["layers"][feature_type] = {"count": len(layer), "cell_deg": layer.index.cell_deg}
+    write_snapshot(SAFETY_SNAPSHOT_PATH, arrays, blobs, meta, created_at=time.time())
 
-    # Fetch and process MRT exit data (with caching)
-    try:
-        mrt_results = fetch_api_data_cached("307a7f61-e302-4108-a817-877ccbfca7c1", "MRT_DATA_CACHE")
-        for item in mrt_results:
-            try:
-                lat = float(item['緯度'])
-                lng = float(item['經度'])
-                distance = haversine(center_lat, center_lng, lat, lng)
-                if distance <= radius_m:
-                    places.append({
-                        "safety": 1,
-                        "type": "metro",
-                        "name": item['出入口名稱'],
-                        "location": {"lat": lat, "lng": lng},
-                        "distance_m": round(distance),
-                        "phone": item.get('電話', '')
-                    })
-            except (KeyError, ValueError):
-                continue  # Skip invalid entries
-    except Exception as e:
-        print(f"Error fetching MRT data: {e}")
+def load_safety_snapshot():
+    """Return (layers, created_at) from the snapshot file, or None if it is missing or too old"""
+    if not SAFETY_SNAPSHOT_PATH or not os.path.exists(SAFETY_SNAPSHOT_PATH):
+        return None
+    header, arrays, blobs = read_snapshot(SAFETY_SNAPSHOT_PATH)
+    created_at = header.get("created_at") or 0
+    if time.time() - created_at > SAFETY_SNAPSHOT_MAX_AGE:
+        print(f"Snapshot {SAFETY_SNAPSHOT_PATH} is too old ({int(time.time() - created_at)}s), ignoring it")
+        return None
+    
+    layers = {}
+    for feature_type in SAFETY_FEATURE_TYPES:
+        info = header["meta"]["layers"][feature_type]
+        records = None
+        if f"{feature_type}.records" in blobs:
+            records = json.loads(blobs[f"{feature_type}.records"].decode('utf-8'))
+        index = GridIndex.from_arrays(info["cell_deg"], arrays[f"{feature_type}.index_order"],
+                                      arrays[f"{feature_type}.index_keys"])
+        layers[feature_type] = SafetyLayer(arrays[f"{feature_type}.lats"], arrays[f"{feature_type}.lngs"],
+                                           ids=arrays[f"{feature_type}.ids"], records=records, index=index)
+    return layers, created_at
 
-    # Fetch and process robbery incident data (with caching)
-    try:
-        robbery_results = fetch_api_data_cached("6ecb4c41-fbc9-4b04-b182-a7da6c780f8d", "ROBBERY_DATA_CACHE")
-        for item in robbery_results:
-            try:
-                lat = float(item['緯度'])
-                lng = float(item['經度'])
-                distance = haversine(center_lat, center_lng, lat, lng)
-                if distance <= radius_m:
-                    places.append({
-                        "safety": -1,  # Negative safety indicator
-                        "type": "robbery_incident",
-                        "name": f"搶奪案件 - {item.get('發生日期', 'Unknown')}",
-                        "location": {"lat": lat, "lng": lng},
-                        "distance_m": round(distance),
-                        "incident_date": item.get('發生日期', ''),
-                        "incident_time": item.get('發生時段', ''),
-                        "location_desc": item.get('發生地點', ''),
-                        "phone": item.get('電話', '')
-                    })
-            except (KeyError, ValueError):
-                continue  # Skip invalid entries
-    except Exception as e:
-        print(f"Error fetching robbery data: {e}")
+def warm_start_from_snapshot():
+    """
+    Runs once, before the first dataset load: if a fresh enough snapshot exists, serve the
+    layers from it and refresh every dataset from its source in the background.
+    """
+    global SNAPSHOT_CHECKED, SNAPSHOT_SAVED_VERSION
+    with SNAPSHOT_LOCK:
+        if SNAPSHOT_CHECKED:
+            return
+        SNAPSHOT_CHECKED = True
+        try:
+            loaded = load_safety_snapshot()
+        except Exception as e:
+            print(f"Failed to load snapshot {SAFETY_SNAPSHOT_PATH}: {e}")
+            return
+        if loaded is None:
+            return
+        
+        layers, created_at = loaded
+        for feature_type, layer in layers.items():
+            SAFETY_DATASETS[feature_type].set(layer, loaded_at=created_at)
+        SNAPSHOT_SAVED_VERSION = SAFETY_DATA_VERSION
+        print(f"Loaded safety layers from snapshot (age: {int(time.time() - created_at)}s), refreshing in background")
+    
+    # The new snapshot is written by get_safety_layers once the refreshed layers are in
+    for dataset in SAFETY_DATASETS.values():
+        dataset.refresh_async()
+
+def save_safety_snapshot_async():
+    """Persist the current layers in a background thread if they changed since the last save"""
+    global SNAPSHOT_SAVING
+    if not SAFETY_SNAPSHOT_PATH or SNAPSHOT_SAVED_VERSION == SAFETY_DATA_VERSION:
+        return
+    version = SAFETY_DATA_VERSION
+    layers = {feature_type: SAFETY_DATASETS[feature_type].peek() for feature_type in SAFETY_FEATURE_TYPES}
+    if any(layer is None for layer in layers.values()):
+        return
+    with SNAPSHOT_LOCK:
+        if SNAPSHOT_SAVING:
+            return
+        SNAPSHOT_SAVING = True
+    
+    def save():
+        global SNAPSHOT_SAVING, SNAPSHOT_SAVED_VERSION
+        try:
+            save_safety_snapshot(layers)
+            SNAPSHOT_SAVED_VERSION = version
+            print(f"Saved safety layers snapshot to {SAFETY_SNAPSHOT_PATH}")
+        except Exception as e:
+            print(f"Failed to save snapshot: {e}")
+        finally:
+            SNAPSHOT_SAVING = False
+    
+    threading.Thread(target=save, daemon=True).start()
 
-    # Fetch and process streetlight data
+def get_safety_layer(feature_type):
+    """
+    Return the current indexed layer of a feature type. Only the very first load of a
+    dataset blocks; stale layers are served while they are refreshed in the background.
+    """
+    if not SNAPSHOT_CHECKED:
+        warm_start_from_snapshot()
+    
     try:
-        streetlight_data = fetch_streetlight_data()
-        for item in streetlight_data:
-            try:
-                lat = float(item['緯度'])
-                lng = float(item['經度'])
-                distance = haversine(center_lat, center_lng, lat, lng)
-                if distance <= radius_m:
-                    places.append({
-                        "safety": 1,
-                        "type": "streetlight",
-                        "name": item.get('燈號', 'Unknown'),
-                        "location": {"lat": lat, "lng": lng},
-                        "distance_m": round(distance),
-                        "phone": item.get('電話', '')
-                    })
-            except (KeyError, ValueError):
-                continue  # Skip invalid entries
+        return SAFETY_DATASETS[feature_type].get()
     except Exception as e:
-        print(f"Error fetching streetlight data: {e}")
+        # Missing police data only drops the police term, as before
+        if feature_type != 'police':
+            raise
+        print(f"Error loading police data from ODS: {e}")
+        return SafetyLayer([], [], records=[])
+
+@timed_stage('safety_layers')
+def get_safety_layers():
+    """Load all five safety layers (raises if any dataset fails to load)"""
+    if not SNAPSHOT_CHECKED:
+        warm_start_from_snapshot()
 
-    # Fetch and process police station data from local ODS file
+    # Datasets that were never loaded are fetched at the same time rather than one by one
+    loaded = {}
+    cold = [feature_type for feature_type in SAFETY_FEATURE_TYPES if SAFETY_DATASETS[feature_type].peek() is None]
+    if len(cold) > 1:
+        with ThreadPoolExecutor(max_workers=len(cold)) as executor:
+            loaded = dict(zip(cold, executor.map(get_safety_layer, cold)))
+
+    layers = {
+        feature_type: loaded[feature_type] if feature_type in loaded else get_safety_layer(feature_type)
+        for feature_type in SAFETY_FEATURE_TYPES
+    }
+    save_safety_snapshot_async()
+    return layers
+
+# Feature type -> key of its list in the /get_safety_data resources object
+SAFETY_RESOURCE_KEYS = {
+    'cctv': 'cctv',
+    'metro': 'metro',
+    'robbery_incident': 'criminal',
+    'streetlight': 'streetlight',
+    'police': 'police',
+}
+
+def format_place(feature_type, layer, idx, distance):
+    """Build the /get_safety_data resource dict for one hit of a layer"""
+    place = {
+        "safety": -1 if feature_type == 'robbery_incident' else 1,
+        "type": feature_type,
+        "location": {"lat": float(layer.lats[idx]), "lng": float(layer.lngs[idx])},
+        "distance_m": round(distance),
+    }
+    if feature_type == 'streetlight':
+        place["name"] = str(layer.ids[idx])
+        place["phone"] = ""
+        return place
+    
+    item = layer.record(idx)
+    if feature_type == 'cctv':
+        place["name"] = item['攝影機編號']
+        place["phone"] = item.get('電話', '')
+    elif feature_type == 'metro':
+        place["name"] = item['出入口名稱']
+        place["phone"] = item.get('電話', '')
+    elif feature_type == 'robbery_incident':
+        place["name"] = f"搶奪案件 - {item.get('發生日期', 'Unknown')}"
+        place["incident_date"] = item.get('發生日期', '')
+        place["incident_time"] = item.get('發生時段', '')
+        place["location_desc"] = item.get('發生地點', '')
+        place["phone"] = item.get('電話', '')
+    elif feature_type == 'police':
+        place["name"] = item.get('中文單位名稱', item.get('英文單位名稱', 'Unknown Police Station'))
+        place["phone"] = item.get('電話', '110')
+        place["address"] = item.get('地址', '')
+        place["open_now"] = True
+    return place
+
+def nearest_police_summary(center_lat, center_lng):
+    """Nearest police station with its distance-decay proximity score (see police_score)"""
     try:
-        police_results = load_police_data()
-        for item in police_results:
-            try:
-                # Police data has TWD97 coordinates (POINT_X, POINT_Y)
-                if 'POINT_X' in item and 'POINT_Y' in item:
-                    twd97_x = float(item['POINT_X'])
-                    twd97_y = float(item['POINT_Y'])
-                    lat, lng = twd97_to_wgs84(twd97_x, twd97_y)
-                    
-                    distance = haversine(center_lat, center_lng, lat, lng)
-                    if distance <= radius_m:
-                        name = item.get('中文單位名稱', item.get('英文單位名稱', 'Unknown Police Station'))
-                        address = item.get('地址', '')
-                        phone = item.get('電話', '110')
-                        
-                        places.append({
-                            "safety": 1,
-                            "type": "police",
-                            "name": name,
-                            "location": {"lat": lat, "lng": lng},
-                            "distance_m": round(distance),
-                            "phone": phone,
-                            "address": address,
-                            "open_now": True
-                        })
-            except (KeyError, ValueError, TypeError) as e:
-                continue  # Skip invalid entries
+        layer = get_safety_layer('police')
+        nearest = layer.nearest(center_lat, center_lng, k=1)
     except Exception as e:
         print(f"Error processing police data: {e}")
-
-    # Sort places by distance
-    places.sort(key=lambda x: x['distance_m'])
-
-    # Categorize resources by type (full lists for counting)
-    cctv_list = [p for p in places if p['type'] == 'cctv']
-    metro_list = [p for p in places if p['type'] == 'metro']
-    criminal_list = [p for p in places if p['type'] == 'robbery_incident']
-    light_list = [p for p in places if p['type'] == 'streetlight']
-    police_list = [p for p in places if p['type'] == 'police']
-
-    # Calculate safety score based on weights (using full counts)
-    cctv_count = len(cctv_list)
-    metro_count = len(metro_list)
-    robbery_count = len(criminal_list)
-    streetlight_count = len(light_list)
-    police_count = len(police_list)
-    
-    # Limit resources to 2 items per category for response
-    resources = {
-        "cctv": cctv_list[:2],
-        "metro": metro_list[:2],
-        "criminal": criminal_list[:2],
-        "streetlight": light_list[:2],
-        "police": police_list[:2]
+        return None
+    if not nearest:
+        return None
+    idx, distance = nearest[0]
+    place = format_place('police', layer, idx, distance)
+    return {
+        "name": place["name"],
+        "location": place["location"],
+        "distance_m": place["distance_m"],
+        "proximity_score": round(police_score(distance), 3)
     }
+
+# API endpoint to fetch CCTV, MRT and robbery incident data and transform it
+@app.route('/get_safety_data', methods=['GET'])
+def get_safety_data():
+    # Get parameters from query string
+    at = request.args.get('at', '2025-11-08T23:00:00+08:00')  # Default to example
+    center_lat = float(request.args.get('center_lat', 25.033964))
+    center_lng = float(request.args.get('center_lng', 121.564468))
+    radius_m = int(request.args.get('radius_m', 200))
+    tz = request.args.get('tz', 'Asia/Taipei')
+
+    # Count every layer within the radius but only build dicts for the 2 nearest per category
+    # (one exact pass per layer, so the counts and resources agree)
+    counts = {}
+    resources = {}
+    for feature_type, resource_key in SAFETY_RESOURCE_KEYS.items():
+        try:
+            layer = get_safety_layer(feature_type)
+            count, nearest = layer.nearest_in_radius(center_lat, center_lng, radius_m, k=2)
+        except Exception as e:
+            print(f"Error fetching {feature_type} data: {e}")
+            count, nearest = 0, []
+        counts[feature_type] = count
+        resources[resource_key] = [format_place(feature_type, layer, idx, distance) for idx, distance in nearest]
+
+    cctv_count = counts['cctv']
+    metro_count = counts['metro']
+    robbery_count = counts['robbery_incident']
+    streetlight_count = counts['streetlight']
+    police_count = counts['police']
     
     # Calculate safety score using normalized algorithm
     safety_score = calculate_safety_score(
@@ -458,13 +984,137 @@ def get_safety_data():
         },
         "summary": {
             "safety_score": safety_score,
-            "analysis": analysis
+            "analysis": analysis,
+            "nearest_police": nearest_police_summary(center_lat, center_lng)
         },
         "resources": resources
     }
 
     return jsonify(response_data)
 
+# API endpoint to find the k nearest facilities of one type (e.g. nearest 3 police stations)
+@app.route('/get_nearest_facilities', methods=['GET'])
+def get_nearest_facilities():
+    center_lat = float(request.args.get('center_lat', 25.033964))
+    center_lng = float(request.args.get('center_lng', 121.564468))
+    feature_type = request.args.get('type', 'police')
+    k = min(int(request.args.get('k', 3)), 50)
+    max_distance_m = request.args.get('max_distance_m')
+    max_distance_m = float(max_distance_m) if max_distance_m is not None else None
+    
+    if feature_type not in SAFETY_FEATURE_TYPES:
+        return jsonify({"error": f"Unknown facility type: {feature_type}"}), 400
+    
+    try:
+        layer = get_safety_layer(feature_type)
+    except Exception as e:
+        return jsonify({"error": f"Failed to fetch safety data: {str(e)}"}), 500
+    
+    facilities = []
+    for idx, distance in layer.nearest(center_lat, center_lng, k=k, max_distance_m=max_distance_m):
+        place = format_place(feature_type, layer, idx, distance)
+        if feature_type == 'police':
+            place["proximity_score"] = round(police_score(distance), 3)
+        facilities.append(place)
+    
+    return jsonify({
+        "meta": {
+            "center": {"lat": center_lat, "lng": center_lng},
+            "type": feature_type,
+            "k": k
+        },
+        "facilities": facilities
+    })
+
+# Largest number of points one /get_safety_data_batch request may score
+SAFETY_BATCH_MAX_QUERIES = int(os.environ.get('SAFETY_BATCH_MAX_QUERIES', 1000))
+
+# API endpoint to score many points at once (e.g. every saved place, or the points of a panned map)
+@app.route('/get_safety_data_batch', methods=['POST'])
+def get_safety_data_batch():
+    """
+    Body: {"queries": [{"lat", "lng", "radius_m"?}, ...], "radius_m": 200, "top_k": 0}
+    Counts and scores of all points come from one batched pass per distinct radius;
+    the k nearest resources per category are only looked up when top_k > 0.
+    """
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries')
+    default_radius_m = data.get('radius_m', 200)
+    top_k = data.get('top_k', 0)
+
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "queries must be a non-empty list"}), 400
+    if len(queries) > SAFETY_BATCH_MAX_QUERIES:
+        return jsonify({"error": f"At most {SAFETY_BATCH_MAX_QUERIES} queries per request"}), 400
+    try:
+        lats = np.array([float(q['lat']) for q in queries])
+        lngs = np.array([float(q['lng']) for q in queries])
+        radii = np.array([int(q.get('radius_m', default_radius_m)) for q in queries])
+        top_k = max(0, min(int(top_k), 10))
+    except (TypeError, KeyError, ValueError, AttributeError):
+        return jsonify({"error": "Every query needs numeric lat and lng (and optional radius_m)"}), 400
+
+    try:
+        layers = get_safety_layers()
+    except Exception as e:
+        return jsonify({"error": f"Failed to fetch safety data: {str(e)}"}), 500
+
+    # Exact counts, as in /get_safety_data: with top_k from the same nearest_in_radius pass as
+    # the resources (so they always agree), otherwise one batch per distinct radius (usually one)
+    counts = np.zeros((len(queries), len(SAFETY_FEATURE_TYPES)), dtype=np.int64)
+    nearest = [{} for _ in queries]
+    if top_k:
+        for i, (lat, lng, radius_m) in enumerate(zip(lats.tolist(), lngs.tolist(), radii.tolist())):
+            for column, feature_type in enumerate(SAFETY_FEATURE_TYPES):
+                counts[i, column], nearest[i][feature_type] = layers[feature_type].nearest_in_radius(
+                    lat, lng, radius_m, k=top_k)
+    else:
+        for radius_m in np.unique(radii).tolist():
+            rows = np.flatnonzero(radii == radius_m)
+            counts[rows] = count_features_in_radius_batch(lats[rows], lngs[rows], radius_m, layers)
+    cctv, metro, robbery, streetlight, police = counts.T
+    scores = calculate_safety_score_array(
+        cctv_count=cctv,
+        lamp_count=streetlight,
+        mrt_count=metro,
+        police_count=police,
+        robbery_count=robbery
+    )
+
+    results = []
+    for i, (row, score) in enumerate(zip(counts.tolist(), scores.tolist())):
+        cctv_count, metro_count, robbery_count, streetlight_count, police_count = row
+        lat, lng, radius_m = float(lats[i]), float(lngs[i]), int(radii[i])
+        result = {
+            "center": {"lat": lat, "lng": lng},
+            "radius_m": radius_m,
+            "safety_score": score,
+            "analysis": {
+                "cctv_count": cctv_count,
+                "metro_count": metro_count,
+                "robbery_count": robbery_count,
+                "streetlight_count": streetlight_count,
+                "police_count": police_count
+            }
+        }
+        if top_k:
+            result["resources"] = {
+                resource_key: [
+                    format_place(feature_type, layers[feature_type], idx, distance)
+                    for idx, distance in nearest[i][feature_type]
+                ]
+                for feature_type, resource_key in SAFETY_RESOURCE_KEYS.items()
+            }
+        results.append(result)
+
+    return jsonify({
+        "meta": {
+            "count": len(results),
+            "top_k": top_k
+        },
+        "results": results
+    })
+
 # Helper function to calculate bbox from center point and radius
 def calculate_bbox(center_lat, center_lng, radius_m):
     # Earth radius in meters
@@ -485,221 +1135,291 @@ def calculate_bbox(center_lat, center_lng, radius_m):
     return south, west, north, east
 
 # Helper function to get CCTV, MRT, robbery, streetlight and police data within radius
-def get_safety_features_in_radius(center_lat, center_lng, radius_m, cctv_data, mrt_data, robbery_data, streetlight_data, police_data):
+@timed_stage('radius_query')
+def get_safety_features_in_radius(center_lat, center_lng, radius_m, layers):
+    """Query each indexed safety layer (see get_safety_layers) around a point"""
     features = []
     
     # Check CCTV
-    for item in cctv_data:
-        try:
-            lat = float(item['wgsy'])
-            lng = float(item['wgsx'])
-            distance = haversine(center_lat, center_lng, lat, lng)
-            if distance <= radius_m:
-                features.append({
-                    'type': 'cctv',
-                    'name': item['攝影機編號'],
-                    'lat': lat,
-                    'lng': lng,
-                    'distance': distance
-                })
-        except (KeyError, ValueError):
-            continue
+    layer = layers['cctv']
+    for idx, distance in layer.query_radius(center_lat, center_lng, radius_m):
+        features.append({
+            'type': 'cctv',
+            'name': layer.record(idx)['攝影機編號'],
+            'lat': float(layer.lats[idx]),
+            'lng': float(layer.lngs[idx]),
+            'distance': distance
+        })
     
     # Check MRT
-    for item in mrt_data:
-        try:
-            lat = float(item['緯度'])
-            lng = float(item['經度'])
-            distance = haversine(center_lat, center_lng, lat, lng)
-            if distance <= radius_m:
-                features.append({
-                    'type': 'metro',
-                    'name': item['出入口名稱'],
-                    'lat': lat,
-                    'lng': lng,
-                    'distance': distance
-                })
-        except (KeyError, ValueError):
-            continue
+    layer = layers['metro']
+    for idx, distance in layer.query_radius(center_lat, center_lng, radius_m):
+        features.append({
+            'type': 'metro',
+            'name': layer.record(idx)['出入口名稱'],
+            'lat': float(layer.lats[idx]),
+            'lng': float(layer.lngs[idx]),
+            'distance': distance
+        })
     
     # Check robbery incidents
-    for item in robbery_data:
-        try:
-            lat = float(item['緯度'])
-            lng = float(item['經度'])
-            distance = haversine(center_lat, center_lng, lat, lng)
-            if distance <= radius_m:
-                features.append({
-                    'type': 'robbery_incident',
-                    'name': f"搶奪案件 - {item.get('發生日期', 'Unknown')}",
-                    'lat': lat,
-                    'lng': lng,
-                    'distance': distance,
-                    'incident_date': item.get('發生日期', ''),
-                    'incident_time': item.get('發生時段', '')
-                })
-        except (KeyError, ValueError):
-            continue
+    layer = layers['robbery_incident']
+    for idx, distance in layer.query_radius(center_lat, center_lng, radius_m):
+        item = layer.record(idx)
+        features.append({
+            'type': 'robbery_incident',
+            'name': f"搶奪案件 - {item.get('發生日期', 'Unknown')}",
+            'lat': float(layer.lats[idx]),
+            'lng': float(layer.lngs[idx]),
+            'distance': distance,
+            'incident_date': item.get('發生日期', ''),
+            'incident_time': item.get('發生時段', '')
+        })
     
     # Check streetlights
-    for item in streetlight_data:
-        try:
-            lat = float(item['緯度'])
-            lng = float(item['經度'])
-            distance = haversine(center_lat, center_lng, lat, lng)
-            if distance <= radius_m:
-                features.append({
-                    'type': 'streetlight',
-                    'name': item.get('燈號', 'Unknown'),
-                    'lat': lat,
-                    'lng': lng,
-                    'distance': distance
-                })
-        except (KeyError, ValueError):
-            continue
+    layer = layers['streetlight']
+    for idx, distance in layer.query_radius(center_lat, center_lng, radius_m):
+        features.append({
+            'type': 'streetlight',
+            'name': str(layer.ids[idx]),
+            'lat': float(layer.lats[idx]),
+            'lng': float(layer.lngs[idx]),
+            'distance': distance
+        })
     
-    # Check police stations
-    for item in police_data:
-        try:
-            # Police data has TWD97 coordinates (POINT_X, POINT_Y)
-            if 'POINT_X' in item and 'POINT_Y' in item:
-                twd97_x = float(item['POINT_X'])
-                twd97_y = float(item['POINT_Y'])
-                lat, lng = twd97_to_wgs84(twd97_x, twd97_y)
-                
-                distance = haversine(center_lat, center_lng, lat, lng)
-                if distance <= radius_m:
-                    name = item.get('中文單位名稱', item.get('英文單位名稱', 'Unknown Police Station'))
-                    
-                    features.append({
-                        'type': 'police',
-                        'name': name,
-                        'lat': lat,
-                        'lng': lng,
-                        'distance': distance
-                    })
-        except (KeyError, ValueError, TypeError):
-            continue
+    # Check police stations (coordinates were converted from TWD97 at load time)
+    layer = layers['police']
+    for idx, distance in layer.query_radius(center_lat, center_lng, radius_m):
+        item = layer.record(idx)
+        features.append({
+            'type': 'police',
+            'name': item.get('中文單位名稱', item.get('英文單位名稱', 'Unknown Police Station')),
+            'lat': float(layer.lats[idx]),
+            'lng': float(layer.lngs[idx]),
+            'distance': distance
+        })
     
     return features
 
-# API endpoint to get nearby roads safety score (single center point)
-@app.route('/get_nearby_roads_safety', methods=['GET'])
-def get_nearby_roads_safety():
-    # Get parameters - only need center point
-    center_lat = float(request.args.get('center_lat'))
-    center_lng = float(request.args.get('center_lng'))
-    search_radius_m = int(request.args.get('search_radius_m', 500))  # Search area for roads
-    safety_radius_m = int(request.args.get('safety_radius_m', 200))  # Radius for safety features
-    
-    # Calculate bbox for searching roads
-    south, west, north, east = calculate_bbox(center_lat, center_lng, search_radius_m)
-    
-    print(f"Fetching roads for center ({center_lat}, {center_lng}) with search_radius={search_radius_m}m, safety_radius={safety_radius_m}m")
-    
-    # Query Overpass API for roads with retry logic
-    max_retries = 3
-    retry_delay = 2
-    result = None
-    
-    for attempt in range(max_retries):
-        try:
-            query = f"""
-            [out:json][timeout:25];
-            (
-              way["highway"]["highway"!~"motorway|motorway_link|trunk|trunk_link"]({south},{west},{north},{east});
-            );
-            out body;
-            >;
-            out skel qt;
-            """
-            print(f"Querying Overpass API (attempt {attempt + 1}/{max_retries})...")
-            result = overpass_api.query(query)
-            print(f"Found {len(result.ways)} road segments")
-            break
-        except Exception as e:
-            error_msg = str(e)
-            print(f"Overpass API error (attempt {attempt + 1}/{max_retries}): {error_msg}")
-            
-            if attempt < max_retries - 1:
-                if "load too high" in error_msg.lower() or "rate limit" in error_msg.lower():
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    return jsonify({"error": f"Overpass API error: {error_msg}"}), 500
-            else:
-                return jsonify({"error": f"Overpass API error after {max_retries} attempts: {error_msg}"}), 500
-    
-    if result is None:
-        return jsonify({"error": "Failed to query Overpass API"}), 500
-    
-    # Fetch CCTV, MRT, robbery, streetlight and police data once (with caching)
-    print("Fetching safety data from Taipei APIs...")
+# Helper function to count CCTV, MRT, robbery, streetlight and police data around many points at once
+@timed_stage('point_scoring', points_arg=0)
+def count_features_in_radius_batch(lats, lngs, radius_m, layers):
+    """
+    Return an N x 5 count matrix for N query points, columns in SAFETY_FEATURE_TYPES order
+    (cctv, metro, robbery_incident, streetlight, police). Use this instead of
+    get_safety_features_in_radius when only the counts are needed.
+    """
+    counts = np.zeros((len(lats), len(SAFETY_FEATURE_TYPES)), dtype=np.int64)
+    for column, feature_type in enumerate(SAFETY_FEATURE_TYPES):
+        counts[:, column] = layers[feature_type].count_in_radius_batch(lats, lngs, radius_m)
+    return counts
+
+# Route scoring modes: 'samples' counts circles around up to ~25 sampled route points,
+# 'corridor' counts every feature within radius_m of the route once, at its nearest edge
+ROUTE_SCORING_MODES = ('samples', 'corridor')
+
+def count_features_along_route(lats, lngs, radius_m, layers):
+    """Corridor counts: (len(lats) - 1) x 5 matrix, one row per route edge, columns in SAFETY_FEATURE_TYPES order"""
+    counts = np.zeros((max(len(lats) - 1, 0), len(SAFETY_FEATURE_TYPES)), dtype=np.int64)
+    for column, feature_type in enumerate(SAFETY_FEATURE_TYPES):
+        counts[:, column] = layers[feature_type].count_along_polyline(lats, lngs, radius_m)
+    return counts
+
+@timed_stage('corridor_scoring', points_arg=0)
+def score_route_corridor(coordinates, radius_m, layers):
+    """
+    Split a [[lat, lng], ...] route into consecutive sections of about 2 * radius_m (the
+    stretch one sample circle covers) and return (section midpoints, section count rows).
+    Counts come from count_features_along_route, so a feature near several sections is
+    only counted in the one holding its nearest edge.
+    """
+    lats = np.array([c[0] for c in coordinates], dtype=np.float64)
+    lngs = np.array([c[1] for c in coordinates], dtype=np.float64)
+    edge_counts = count_features_along_route(lats, lngs, radius_m, layers)
+    
+    # Distance along the route at every point; edges go to the section holding their middle
+    edge_lengths = haversine_np(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+    along = np.concatenate(([0.0], np.cumsum(edge_lengths)))
+    section_m = max(2 * radius_m, 1)
+    _, section_of_edge = np.unique(np.floor((along[:-1] + edge_lengths / 2) / section_m), return_inverse=True)
+    starts = np.flatnonzero(np.diff(section_of_edge, prepend=-1))
+    counts = np.add.reduceat(edge_counts, starts, axis=0) if len(starts) else edge_counts
+    
+    # Each section is located at the point halfway along it
+    section_ends = np.append(starts[1:], len(edge_lengths))
+    middles = (along[starts] + along[section_ends]) / 2
+    points = [[float(lat), float(lng)] for lat, lng in zip(np.interp(middles, along, lats), np.interp(middles, along, lngs))]
+    return points, counts
+
+def query_overpass(query):
+    """
+    Run an Overpass QL query through the shared HTTP client and parse it with overpy.
+    Raises the same overpy exceptions as Overpass.query for error statuses; there is no
+    retry loop, repeated failures open the circuit for Overpass instead.
+    """
+    response = http_client.post(OVERPASS_URL, data=query.encode('utf-8'), timeout=(3.05, 30))
+    if response.status_code == 429:
+        raise overpy.exception.OverpassTooManyRequests()
+    if response.status_code == 504:
+        raise overpy.exception.OverpassGatewayTimeout()
+    if response.status_code != 200:
+        raise overpy.exception.OverpassUnknownHTTPStatusCode(response.status_code)
+    return overpass_api.parse_json(response.content)
+
+def fetch_roads_in_bbox(south, west, north, east):
+    """Query Overpass for the roads in a bbox and return them as light way dicts"""
+    query = f"""
+    [out:json][timeout:25];
+    (
+      way["highway"]["highway"!~"motorway|motorway_link|trunk|trunk_link"]({south:.7f},{west:.7f},{north:.7f},{east:.7f});
+    );
+    out body;
+    >;
+    out skel qt;
+    """
+    result = query_overpass(query)
+    return [
+        {
+            'id': way.id,
+            'nodes': tuple((float(node.lat), float(node.lon)) for node in way.nodes),
+            'tags': {key: way.tags[key] for key in ('name', 'highway') if key in way.tags}
+        }
+        for way in result.ways
+    ]
+
+# Overpass road geometry cached by fixed tiles (0.01 degree, about 1 km)
+ROAD_TILE_CACHE_TTL = int(os.environ.get('ROAD_TILE_CACHE_TTL', 86400))  # Roads rarely change, keep tiles 1 day
+ROAD_TILE_CACHE_MAX_TILES = int(os.environ.get('ROAD_TILE_CACHE_MAX_TILES', 4096))
+ROAD_CACHE = RoadTileCache(fetch_roads_in_bbox, tile_deg=0.01, ttl=ROAD_TILE_CACHE_TTL,
+                           max_tiles=ROAD_TILE_CACHE_MAX_TILES)
+
+# Local OSM extract (.osm XML) of Taipei; when set, roads are read from it instead of Overpass
+OSM_EXTRACT_PATH = os.environ.get('OSM_EXTRACT_PATH', '')
+ROAD_GRAPH_DATASET = DatasetManager('road_graph', lambda: RoadGraph.from_osm_xml(OSM_EXTRACT_PATH))
+ROAD_GRAPH_LOAD_STARTED = False
+
+def get_road_graph():
+    """
+    Return the local road graph, or None if no extract is configured or it is still loading.
+    The first call starts loading it in the background; until then callers use Overpass.
+    """
+    global ROAD_GRAPH_LOAD_STARTED
+    if not OSM_EXTRACT_PATH:
+        return None
+    graph = ROAD_GRAPH_DATASET.peek()
+    if graph is None and not ROAD_GRAPH_LOAD_STARTED:
+        ROAD_GRAPH_LOAD_STARTED = True
+        ROAD_GRAPH_DATASET.refresh_async()
+    return graph
+
+@timed_stage('road_query')
+def get_roads_in_bbox(south, west, north, east):
+    """Roads with a node in the bbox, from the local road graph if loaded, else from Overpass"""
+    graph = get_road_graph()
+    if graph is not None:
+        return graph.ways_in_bbox(south, west, north, east)
+    return ROAD_CACHE.get_ways(south, west, north, east)
+
+# Local safety-weighted pedestrian routing over the road graph (used instead of OSRM once ready)
+SAFE_ROUTING_WEIGHT = float(os.environ.get('SAFE_ROUTING_WEIGHT', 1.0))  # 0: plain shortest walk
+SAFE_ROUTING_LANDMARKS = int(os.environ.get('SAFE_ROUTING_LANDMARKS', 8))
+SAFE_ROUTING_SAFETY_RADIUS_M = int(os.environ.get('SAFE_ROUTING_SAFETY_RADIUS_M', 200))  # Features counted around each edge
+SAFE_ROUTER = None
+SAFE_ROUTER_LOCK = threading.Lock()
+SAFE_ROUTER_BUILDING = False
+
+def build_safe_router(graph):
+    """Score every edge of the road graph and build the router (runs in a background thread)"""
+    global SAFE_ROUTER, SAFE_ROUTER_BUILDING
     try:
-        cctv_data = fetch_api_data_cached("d317a3c4-ff08-48af-894e-31dfb5155de3", "CCTV_DATA_CACHE")
-        print(f"Loaded {len(cctv_data)} CCTV cameras")
-        mrt_data = fetch_api_data_cached("307a7f61-e302-4108-a817-877ccbfca7c1", "MRT_DATA_CACHE")
-        print(f"Loaded {len(mrt_data)} MRT exits")
-        robbery_data = fetch_api_data_cached("6ecb4c41-fbc9-4b04-b182-a7da6c780f8d", "ROBBERY_DATA_CACHE")
-        print(f"Loaded {len(robbery_data)} robbery incidents")
+        start = time.time()
+        # Version before layers: if they are swapped in between, the router is stale, never falsely current
+        version = SAFETY_DATA_VERSION
+        layers = get_safety_layers()
         
-        # Pre-filter streetlights to search area to avoid processing 145k items per road
-        all_streetlight_data = fetch_streetlight_data()
-        print(f"Loaded {len(all_streetlight_data)} streetlights, filtering to search area...")
-        streetlight_data = []
-        for item in all_streetlight_data:
-            try:
-                lat = float(item['緯度'])
-                lng = float(item['經度'])
-                # Pre-filter to search area (with extra margin for safety_radius)
-                if south - 0.01 <= lat <= north + 0.01 and west - 0.01 <= lng <= east + 0.01:
-                    streetlight_data.append(item)
-            except (KeyError, ValueError):
-                continue
-        print(f"Filtered to {len(streetlight_data)} streetlights in search area")
+        # Edge safety from the features around each edge's midpoint
+        src = np.repeat(np.arange(len(graph.lats)), np.diff(graph.adj_offsets))
+        mid_lats = (graph.lats[src] + graph.lats[graph.adj_targets]) / 2
+        mid_lngs = (graph.lngs[src] + graph.lngs[graph.adj_targets]) / 2
+        counts = count_features_in_radius_batch(mid_lats, mid_lngs, SAFE_ROUTING_SAFETY_RADIUS_M, layers)
+        cctv, metro, robbery, streetlight, police = counts.T
+        edge_safety = calculate_safety_score_array(
+            cctv_count=cctv,
+            lamp_count=streetlight,
+            mrt_count=metro,
+            police_count=police,
+            robbery_count=robbery
+        )
         
-        police_data = load_police_data()
-        print(f"Loaded {len(police_data)} police stations")
+        SAFE_ROUTER = SafeRouter(graph, edge_safety, safety_weight=SAFE_ROUTING_WEIGHT,
+                                 landmarks=SAFE_ROUTING_LANDMARKS, version=version)
+        print(f"Safe router built: {len(graph.adj_targets)} edges in {time.time() - start:.1f}s")
     except Exception as e:
-        print(f"Failed to fetch safety data: {str(e)}")
-        return jsonify({"error": f"Failed to fetch safety data: {str(e)}"}), 500
-    
-    # Process each road segment
-    road_segments = []
-    total_cctv = 0
-    total_metro = 0
-    total_robbery = 0
-    total_streetlight = 0
-    total_police = 0
-    
-    print(f"Processing {len(result.ways)} road segments...")
-    for idx, way in enumerate(result.ways):
-        if idx % 100 == 0 and idx > 0:
-            print(f"  Processed {idx}/{len(result.ways)} roads...")
-        
-        # Get road nodes (coordinates)
-        nodes = [(float(node.lat), float(node.lon)) for node in way.nodes]
-        
-        if len(nodes) < 2:
-            continue
-        
-        # Calculate midpoint of the segment
-        mid_lat = sum(n[0] for n in nodes) / len(nodes)
-        mid_lng = sum(n[1] for n in nodes) / len(nodes)
-        
-        # Get safety features around this segment
-        features = get_safety_features_in_radius(mid_lat, mid_lng, safety_radius_m, cctv_data, mrt_data, robbery_data, streetlight_data, police_data)
-        
-        # Count by type
-        cctv_count = sum(1 for f in features if f['type'] == 'cctv')
-        metro_count = sum(1 for f in features if f['type'] == 'metro')
-        robbery_count = sum(1 for f in features if f['type'] == 'robbery_incident')
-        streetlight_count = sum(1 for f in features if f['type'] == 'streetlight')
-        police_count = sum(1 for f in features if f['type'] == 'police')
-        
-        # Calculate segment safety score using normalized algorithm
-        segment_score = calculate_safety_score(
+        print(f"Failed to build safe router: {e}")
+    finally:
+        with SAFE_ROUTER_LOCK:
+            SAFE_ROUTER_BUILDING = False
+
+def get_safe_router():
+    """
+    Return the router for the loaded road graph, or None while there is none yet.
+    A router built from older safety data is still returned while a rebuild runs.
+    """
+    global SAFE_ROUTER_BUILDING
+    graph = get_road_graph()
+    if graph is None:
+        return None
+    router = SAFE_ROUTER
+    if router is None or router.graph is not graph or router.version != SAFETY_DATA_VERSION:
+        with SAFE_ROUTER_LOCK:
+            if not SAFE_ROUTER_BUILDING:
+                SAFE_ROUTER_BUILDING = True
+                threading.Thread(target=build_safe_router, args=(graph,), daemon=True).start()
+    if router is None or router.graph is not graph:
+        return None
+    return router
+
+@timed_stage('local_routing')
+def find_local_routes(router, start_lat, start_lng, end_lat, end_lng, k=3):
+    """
+    Safety-weighted walking routes from the local router, shaped like OSRM routes
+    (GeoJSON [lng, lat] geometry, distance in meters, duration in seconds).
+    Returns None if either end is not near a road or no path connects them.
+    """
+    source = router.graph.nearest_node(start_lat, start_lng)
+    target = router.graph.nearest_node(end_lat, end_lng)
+    if source is None or target is None:
+        return None
+    routes = []
+    for edges in router.alternatives(source, target, k=k):
+        distance = router.route_length(edges)
+        routes.append({
+            'geometry': {'coordinates': [[lng, lat] for lat, lng in router.route_geometry(source, edges)]},
+            'distance': round(distance, 1),
+            'duration': round(distance / WALKING_SPEED_MS, 1)
+        })
+    return routes or None
+
+# Large /get_nearby_roads_safety queries score their roads on a process pool (0 or 1 process disables it)
+ROAD_SCORING_PROCESSES = int(os.environ.get('ROAD_SCORING_PROCESSES', os.cpu_count() or 1))
+ROAD_SCORING_PROCESS_THRESHOLD = int(os.environ.get('ROAD_SCORING_PROCESS_THRESHOLD', 2000))  # Fewer roads stay in-process
+ROAD_SCORING_POOL = None
+ROAD_SCORING_POOL_VERSION = None
+ROAD_SCORING_POOL_LOCK = threading.Lock()
+ROAD_SCORING_POOL_BUILDING = False
+
+# Counting layers of a pool worker, received once when the worker starts
+_WORKER_LAYERS = None
+
+def _init_road_scoring_worker(layers):
+    global _WORKER_LAYERS
+    _WORKER_LAYERS = layers
+
+def score_road_points(lats, lngs, radius_m, layers):
+    """Return (N x 5 count matrix, safety score list) for road midpoints"""
+    counts = count_features_in_radius_batch(lats, lngs, radius_m, layers)
+    scores = [
+        calculate_safety_score(
             cctv_count=cctv_count,
             lamp_count=streetlight_count,
             mrt_count=metro_count,
@@ -708,82 +1428,452 @@ def get_nearby_roads_safety():
             robbery_count=robbery_count,
             store_count=0  # TODO: Add convenience store data
         )
+        for cctv_count, metro_count, robbery_count, streetlight_count, police_count in counts.tolist()
+    ]
+    return counts, scores
+
+def _score_road_chunk(task):
+    lats, lngs, radius_m = task
+    return score_road_points(lats, lngs, radius_m, _WORKER_LAYERS)
+
+def build_road_scoring_pool():
+    """
+    Start a worker pool for the current layers (runs in a background thread). Workers get
+    the point arrays and indexes of every layer once, through the pool initializer; tasks
+    only carry road midpoints. The previous pool finishes its running tasks and exits.
+    """
+    global ROAD_SCORING_POOL, ROAD_SCORING_POOL_VERSION, ROAD_SCORING_POOL_BUILDING
+    try:
+        start = time.time()
+        version = SAFETY_DATA_VERSION
+        layers = {
+            feature_type: SafetyLayer(layer.lats, layer.lngs, ids=layer.ids, index=layer.index)
+            for feature_type, layer in get_safety_layers().items()
+        }
+        # Fresh interpreters rather than forks of this multi-threaded server
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        pool = multiprocessing.get_context(method).Pool(
+            ROAD_SCORING_PROCESSES, initializer=_init_road_scoring_worker, initargs=(layers,)
+        )
+        # Only hand out the pool once its workers can answer
+        pool.apply(_score_road_chunk, ((np.zeros(1), np.zeros(1), 1),))
+        old_pool = ROAD_SCORING_POOL
+        ROAD_SCORING_POOL, ROAD_SCORING_POOL_VERSION = pool, version
+        if old_pool is not None:
+            old_pool.close()
+        print(f"Road scoring pool ready: {ROAD_SCORING_PROCESSES} processes in {time.time() - start:.1f}s")
+    except Exception as e:
+        print(f"Failed to start road scoring pool: {e}")
+    finally:
+        with ROAD_SCORING_POOL_LOCK:
+            ROAD_SCORING_POOL_BUILDING = False
+
+def get_road_scoring_pool():
+    """Return the worker pool if it matches the current datasets, otherwise start one and return None"""
+    global ROAD_SCORING_POOL_BUILDING
+    if ROAD_SCORING_PROCESSES <= 1:
+        return None
+    pool = ROAD_SCORING_POOL
+    if pool is not None and ROAD_SCORING_POOL_VERSION == SAFETY_DATA_VERSION:
+        return pool
+    with ROAD_SCORING_POOL_LOCK:
+        if not ROAD_SCORING_POOL_BUILDING:
+            ROAD_SCORING_POOL_BUILDING = True
+            threading.Thread(target=build_road_scoring_pool, daemon=True).start()
+    return None
+
+@atexit.register
+def shutdown_road_scoring_pool():
+    if ROAD_SCORING_POOL is not None:
+        ROAD_SCORING_POOL.terminate()
+
+@timed_stage('road_scoring', points_arg=0)
+def score_roads(lats, lngs, radius_m, layers):
+    """
+    (counts, scores) for road midpoints. Large batches are split across the process pool
+    (results merged in order).
+    """
+    if len(lats) >= ROAD_SCORING_PROCESS_THRESHOLD:
+        pool = get_road_scoring_pool()
+        if pool is not None:
+            lats = np.asarray(lats, dtype=np.float64)
+            lngs = np.asarray(lngs, dtype=np.float64)
+            # Neighbouring roads in one chunk keep each worker's index lookups local
+            order = np.lexsort((lngs, lats))
+            chunks = np.array_split(order, ROAD_SCORING_PROCESSES * 2)
+            results = pool.map(_score_road_chunk, [(lats[chunk], lngs[chunk], radius_m) for chunk in chunks])
+            counts = np.zeros((len(lats), len(SAFETY_FEATURE_TYPES)), dtype=np.int64)
+            scores = [0.0] * len(lats)
+            for chunk, (chunk_counts, chunk_scores) in zip(chunks, results):
+                counts[chunk] = chunk_counts
+                for position, score in zip(chunk.tolist(), chunk_scores):
+                    scores[position] = score
+            return counts, scores
+    return score_road_points(lats, lngs, radius_m, layers)
+
+# Per-road results written by score_roads.py, reloaded periodically so re-runs are picked up
+ROAD_SCORES_PATH = os.environ.get('ROAD_SCORES_PATH', 'snapshot/road_scores.snap')
+ROAD_SCORES_RELOAD = int(os.environ.get('ROAD_SCORES_RELOAD', 300))
+ROAD_SCORES_DATASET = DatasetManager('road_scores', lambda: RoadScores.from_file(ROAD_SCORES_PATH), ttl=ROAD_SCORES_RELOAD)
+
+# Feature type -> per-road count key in the road safety responses
+ROAD_COUNT_KEYS = {
+    'cctv': 'cctv_count',
+    'metro': 'metro_count',
+    'robbery_incident': 'robbery_count',
+    'streetlight': 'streetlight_count',
+    'police': 'police_count',
+}
+
+def get_road_scores(radius_m):
+    """Return the precomputed road scores if they exist for radius_m, else None"""
+    if not ROAD_SCORES_PATH or not os.path.exists(ROAD_SCORES_PATH):
+        return None
+    try:
+        road_scores = ROAD_SCORES_DATASET.get()
+    except Exception as e:
+        print(f"Failed to load road scores {ROAD_SCORES_PATH}: {e}")
+        return None
+    if road_scores.radius_m != radius_m:
+        return None
+    return road_scores
+
+def iter_precomputed_road_segments(road_scores, south, west, north, east):
+    """Road segments with a node in the bbox, read straight from the road scores file"""
+    for row in road_scores.ways_in_bbox(south, west, north, east).tolist():
+        tags = road_scores.tags[row]
+        segment = {
+            'road_name': tags.get('name', 'Unknown Road'),
+            'road_type': tags.get('highway', 'unknown'),
+            'nodes': road_scores.nodes(row),
+            'center': {'lat': float(road_scores.center_lats[row]), 'lng': float(road_scores.center_lngs[row])},
+        }
+        for feature_type, count in zip(road_scores.feature_types, road_scores.counts[row].tolist()):
+            segment[ROAD_COUNT_KEYS[feature_type]] = count
+        segment['safety_score'] = float(road_scores.scores[row])
+        yield segment
+
+def iter_live_road_segments(road_ways, safety_radius_m, layers, chunk_size=None):
+    """
+    Score roads and yield their segment dicts. Roads are counted chunk_size at a time
+    (all in one batch if None), so a streaming caller gets the first ones early.
+    """
+    # Collect every road with its midpoint first so they can be counted in batches
+    ways = []
+    for way in road_ways:
+        # Get road nodes (coordinates)
+        nodes = list(way['nodes'])
         
-        road_segments.append({
-            'road_name': way.tags.get('name', 'Unknown Road'),
-            'road_type': way.tags.get('highway', 'unknown'),
-            'nodes': nodes,
-            'center': {'lat': mid_lat, 'lng': mid_lng},
-            'cctv_count': cctv_count,
-            'metro_count': metro_count,
-            'robbery_count': robbery_count,
-            'streetlight_count': streetlight_count,
-            'police_count': police_count,
-            'safety_score': segment_score
-        })
+        if len(nodes) < 2:
+            continue
         
-        total_cctv += cctv_count
-        total_metro += metro_count
-        total_robbery += robbery_count
-        total_streetlight += streetlight_count
-        total_police += police_count
+        # Calculate midpoint of the segment
+        mid_lat = sum(n[0] for n in nodes) / len(nodes)
+        mid_lng = sum(n[1] for n in nodes) / len(nodes)
+        ways.append((way, nodes, mid_lat, mid_lng))
+    
+    print(f"Processing {len(ways)} road segments...")
     
-    # Calculate overall area safety score using normalized algorithm
+    step = chunk_size or max(len(ways), 1)
+    for start in range(0, len(ways), step):
+        chunk = ways[start:start + step]
+        # Count safety features around every segment and score it (on the process pool for large areas)
+        counts, scores = score_roads([w[2] for w in chunk], [w[3] for w in chunk], safety_radius_m, layers)
+        
+        for (way, nodes, mid_lat, mid_lng), row, segment_score in zip(chunk, counts.tolist(), scores):
+            cctv_count, metro_count, robbery_count, streetlight_count, police_count = row
+            
+            yield {
+                'road_name': way['tags'].get('name', 'Unknown Road'),
+                'road_type': way['tags'].get('highway', 'unknown'),
+                'nodes': nodes,
+                'center': {'lat': mid_lat, 'lng': mid_lng},
+                'cctv_count': cctv_count,
+                'metro_count': metro_count,
+                'robbery_count': robbery_count,
+                'streetlight_count': streetlight_count,
+                'police_count': police_count,
+                'safety_score': segment_score
+            }
+
+def safety_level(score):
+    """(level, label) of a safety score"""
+    if score >= 60:
+        return 3, "安全"
+    elif score >= 40:
+        return 2, "需注意"
+    return 1, "危險"
+
+def label_segment(segment):
+    """Add the level and label of a segment's safety score"""
+    segment['level'], segment['label'] = safety_level(segment['safety_score'])
+    return segment
+
+# Segment count field -> summary total field
+SEGMENT_TOTAL_KEYS = {
+    'cctv_count': 'total_cctv',
+    'metro_count': 'total_metro',
+    'robbery_count': 'total_robbery',
+    'streetlight_count': 'total_streetlight',
+    'police_count': 'total_police',
+}
+
+def segments_summary(totals, count_key, count):
+    """Summary object of a set of segments from their summed counts (keyed like SEGMENT_TOTAL_KEYS)"""
+    # Calculate overall safety score using normalized algorithm
     overall_score = calculate_safety_score(
-        cctv_count=total_cctv,
-        lamp_count=total_streetlight,
-        mrt_count=total_metro,
-        police_count=total_police,
+        cctv_count=totals['cctv_count'],
+        lamp_count=totals['streetlight_count'],
+        mrt_count=totals['metro_count'],
+        police_count=totals['police_count'],
         theft_count=0,  # No theft data in this endpoint
-        robbery_count=total_robbery,
+        robbery_count=totals['robbery_count'],
         store_count=0  # TODO: Add convenience store data
     )
+    summary = {count_key: count}
+    for key, total_key in SEGMENT_TOTAL_KEYS.items():
+        summary[total_key] = totals[key]
+    summary['overall_score'] = overall_score
+    summary['level'], summary['label'] = safety_level(overall_score)
+    return summary
+
+# Response formats: 'full' returns geometry as [[lat, lng], ...], 'compact' as encoded polylines
+RESPONSE_FORMATS = ('full', 'compact')
+
+def parse_format_params(params):
+    """(format, simplify_m) from request args or a JSON body; raises ValueError if invalid"""
+    response_format = params.get('format', 'full')
+    simplify_m = float(params.get('simplify_m', 0))
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Invalid format, expected one of {', '.join(RESPONSE_FORMATS)}")
+    if simplify_m < 0:
+        raise ValueError("simplify_m must not be negative")
+    return response_format, simplify_m
+
+def compact_geometry(points, simplify_m=0):
+    """Encoded polyline (precision 5) of [[lat, lng], ...], Douglas-Peucker simplified first if simplify_m > 0"""
+    return encode_polyline(simplify_polyline(points, simplify_m) if simplify_m > 0 else points)
+
+def compact_road_segment(segment, simplify_m=0):
+    """Replace a road segment's nodes with their encoded polyline"""
+    segment['polyline'] = compact_geometry(segment.pop('nodes'), simplify_m)
+    return segment
+
+# Roads / route segments scored per NDJSON chunk when streaming
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 256))
+
+def wants_stream(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def stream_segments(segments, record_type, count_key, summary_fields):
+    """
+    NDJSON response: one {"type": record_type, ...segment} line per segment as soon as it
+    is scored, then {"type": "summary", ...summary_fields, "summary": {...}}. Only running
+    totals are kept, never the whole segment list. An error after streaming started is
+    reported as a final {"type": "error"} line.
+    """
+    def generate():
+        totals = dict.fromkeys(SEGMENT_TOTAL_KEYS, 0)
+        count = 0
+        try:
+            for segment in segments:
+                label_segment(segment)
+                for key in totals:
+                    totals[key] += segment[key]
+                count += 1
+                yield app.json.dumps(dict(segment, type=record_type)) + '\n'
+        except Exception as e:
+            print(f"Streaming error: {e}")
+            yield app.json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+            return
+        yield app.json.dumps(dict(summary_fields, type='summary', summary=segments_summary(totals, count_key, count))) + '\n'
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# API endpoint to get nearby roads safety score (single center point)
+@app.route('/get_nearby_roads_safety', methods=['GET'])
+def get_nearby_roads_safety():
+    # Get parameters - only need center point
+    center_lat = float(request.args.get('center_lat'))
+    center_lng = float(request.args.get('center_lng'))
+    search_radius_m = int(request.args.get('search_radius_m', 500))  # Search area for roads
+    safety_radius_m = int(request.args.get('safety_radius_m', 200))  # Radius for safety features
+    stream = wants_stream(request.args.get('stream', ''))  # NDJSON, one road per line
+    try:
+        response_format, simplify_m = parse_format_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    # Determine level and label based on score
-    if overall_score >= 60:
-        level = 3
-        label = "安全"
-    elif overall_score >= 40:
-        level = 2
-        label = "需注意"
-    else:
-        level = 1
-        label = "危險"
+    # Calculate bbox for searching roads
+    south, west, north, east = calculate_bbox(center_lat, center_lng, search_radius_m)
     
-    # Add level and label to each road segment
-    for segment in road_segments:
-        score = segment['safety_score']
-        if score >= 60:
-            segment['level'] = 3
-            segment['label'] = "安全"
-        elif score >= 40:
-            segment['level'] = 2
-            segment['label'] = "需注意"
-        else:
-            segment['level'] = 1
-            segment['label'] = "危險"
+    print(f"Fetching roads for center ({center_lat}, {center_lng}) with search_radius={search_radius_m}m, safety_radius={safety_radius_m}m")
     
-    # Construct response
-    response_data = {
+    # Precomputed per-road scores (score_roads.py) need no road query or counting at all
+    road_scores = get_road_scores(safety_radius_m)
+    if road_scores is not None:
+        segments = iter_precomputed_road_segments(road_scores, south, west, north, east)
+        source = 'precomputed'
+    else:
+        source = 'live'
+        # Get roads from the local road graph, or the Overpass tile cache
+        try:
+            road_ways = get_roads_in_bbox(south, west, north, east)
+            print(f"Found {len(road_ways)} road segments")
+        except Exception as e:
+            print(f"Overpass API error: {e}")
+            return jsonify({"error": f"Overpass API error: {e}"}), 500
+        
+        # Fetch CCTV, MRT, robbery, streetlight and police data once (with caching)
+        print("Fetching safety data from Taipei APIs...")
+        try:
+            layers = get_safety_layers()
+            print(f"Loaded {len(layers['cctv'])} CCTV cameras")
+            print(f"Loaded {len(layers['metro'])} MRT exits")
+            print(f"Loaded {len(layers['robbery_incident'])} robbery incidents")
+            # Streetlights are looked up through the spatial index, no need to pre-filter 145k items
+            print(f"Loaded {len(layers['streetlight'])} streetlights")
+            print(f"Loaded {len(layers['police'])} police stations")
+        except Exception as e:
+            print(f"Failed to fetch safety data: {str(e)}")
+            return jsonify({"error": f"Failed to fetch safety data: {str(e)}"}), 500
+        
+        segments = iter_live_road_segments(road_ways, safety_radius_m, layers,
+                                           chunk_size=STREAM_CHUNK_SIZE if stream else None)
+    
+    response_fields = {
         'center': {'lat': center_lat, 'lng': center_lng},
         'search_radius_m': search_radius_m,
         'safety_radius_m': safety_radius_m,
-        'summary': {
-            'total_roads': len(road_segments),
-            'total_cctv': total_cctv,
-            'total_metro': total_metro,
-            'total_robbery': total_robbery,
-            'total_streetlight': total_streetlight,
-            'total_police': total_police,
-            'overall_score': overall_score,
-            'level': level,
-            'label': label
-        },
-        'roads': road_segments
+        'source': source
     }
+    if response_format == 'compact':
+        segments = (compact_road_segment(segment, simplify_m) for segment in segments)
+        response_fields['format'] = 'compact'
+    if stream:
+        return stream_segments(segments, 'road', 'total_roads', response_fields)
+    
+    # Add level and label to each road segment
+    road_segments = [label_segment(segment) for segment in segments]
+    if source == 'precomputed':
+        print(f"Found {len(road_segments)} precomputed road segments")
+    
+    totals = {key: sum(segment[key] for segment in road_segments) for key in SEGMENT_TOTAL_KEYS}
+    
+    # Construct response
+    response_data = dict(response_fields, summary=segments_summary(totals, 'total_roads', len(road_segments)),
+                         roads=road_segments)
     
     return jsonify(response_data)
 
+# Road safety tiles for map rendering on the standard web-mercator (XYZ) grid, shareable by
+# every client and cacheable by browsers and proxies
+TILE_MIN_ZOOM = int(os.environ.get('TILE_MIN_ZOOM', 14))  # Lower zooms would cover too many roads per tile
+TILE_MAX_ZOOM = int(os.environ.get('TILE_MAX_ZOOM', 18))  # Clients overzoom beyond this
+TILE_SAFETY_RADIUS_M = int(os.environ.get('TILE_SAFETY_RADIUS_M', 200))
+TILE_BUFFER = 1 / 64  # Roads are clipped this fraction of a tile outside it, so lines join across tile edges
+TILE_QUERY_MARGIN = 0.25  # Roads are looked up this fraction of a tile around it, to catch long segments crossing it
+TILE_MAX_AGE = int(os.environ.get('TILE_MAX_AGE', 300))  # Cache-Control max-age, ETags revalidate afterwards
+TILE_CACHE_TTL = int(os.environ.get('TILE_CACHE_TTL', 3600))
+TILE_CACHE_MAX_ENTRIES = int(os.environ.get('TILE_CACHE_MAX_ENTRIES', 4096))
+TILE_CACHE = VersionedCache(ttl=TILE_CACHE_TTL, max_entries=TILE_CACHE_MAX_ENTRIES)  # Tile objects
+
+def expand_bbox(south, west, north, east, fraction):
+    dlat = (north - south) * fraction
+    dlng = (east - west) * fraction
+    return south - dlat, west - dlng, north + dlat, east + dlng
+
+def road_tile_feature(segment, parts):
+    """GeoJSON feature of a labelled road segment clipped to `parts` ([[lat, lng], ...] each)"""
+    lines = [[[round(lng, 6), round(lat, 6)] for lat, lng in part] for part in parts]
+    if len(lines) == 1:
+        geometry = {'type': 'LineString', 'coordinates': lines[0]}
+    else:
+        geometry = {'type': 'MultiLineString', 'coordinates': lines}
+    properties = {key: value for key, value in segment.items() if key not in ('nodes', 'center')}
+    return {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+@timed_stage('tile_render')
+def render_road_tile(z, x, y, safety_radius_m):
+    """
+    GeoJSON FeatureCollection of the scored roads clipped to tile z/x/y, from the precomputed
+    road scores when they match safety_radius_m.
+    """
+    south, west, north, east = tile_bounds(z, x, y)
+    clip_bbox = expand_bbox(south, west, north, east, TILE_BUFFER)
+    query_bbox = expand_bbox(south, west, north, east, TILE_QUERY_MARGIN)
+
+    road_scores = get_road_scores(safety_radius_m)
+    if road_scores is not None:
+        source = 'precomputed'
+        segments = iter_precomputed_road_segments(road_scores, *query_bbox)
+    else:
+        source = 'live'
+        road_ways = get_roads_in_bbox(*query_bbox)
+        layers = get_safety_layers()
+        # Only roads that reach into the tile are scored
+        road_ways = [way for way in road_ways if clip_polyline(list(way['nodes']), *clip_bbox)]
+        segments = iter_live_road_segments(road_ways, safety_radius_m, layers)
+
+    features = []
+    for segment in segments:
+        parts = clip_polyline(segment['nodes'], *clip_bbox)
+        if parts:
+            features.append(road_tile_feature(label_segment(segment), parts))
+
+    return {
+        'type': 'FeatureCollection',
+        'tile': {'z': z, 'x': x, 'y': y},
+        'safety_radius_m': safety_radius_m,
+        'source': source,
+        'features': features
+    }
+
+def tile_version(safety_radius_m):
+    """Data version of tiles: the road scores file, or the live safety layers"""
+    road_scores = get_road_scores(safety_radius_m)
+    if road_scores is not None:
+        return ('precomputed', road_scores.created_at)
+    return ('live', SAFETY_DATA_VERSION)
+
+# API endpoint serving road safety as GeoJSON tiles (/tiles/{z}/{x}/{y})
+@app.route('/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_road_tile(z, x, y):
+    safety_radius_m = int(request.args.get('safety_radius_m', TILE_SAFETY_RADIUS_M))
+    if not TILE_MIN_ZOOM <= z <= TILE_MAX_ZOOM:
+        return jsonify({"error": f"Zoom must be between {TILE_MIN_ZOOM} and {TILE_MAX_ZOOM}"}), 400
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Tile out of range"}), 400
+
+    # Tiles are rendered once per data version; later requests (and every other client) reuse the body.
+    # The version is read before rendering, so a dataset swap mid-render leaves the tile stale, not falsely current
+    key = (z, x, y, safety_radius_m)
+    version = tile_version(safety_radius_m)
+    tile = TILE_CACHE.get(key, version)
+    if tile is None:
+        try:
+            tile_data = render_road_tile(z, x, y, safety_radius_m)
+        except Exception as e:
+            print(f"Failed to render tile {z}/{x}/{y}: {e}")
+            return jsonify({"error": f"Failed to render tile: {e}"}), 500
+        tile = Tile(app.json.dumps(tile_data).encode('utf-8'))
+        TILE_CACHE.put(key, tile, version)
+
+    # One weak ETag for every content coding of the same tile
+    if request.if_none_match.contains_weak(tile.etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(tile.body, mimetype='application/geo+json')
+        compression = negotiate_compression() if len(tile.body) >= COMPRESS_MIN_BYTES > 0 else None
+        if compression is not None:
+            coding, compress = compression
+            # Compressed once per tile and served from the cache afterwards
+            response.set_data(tile.encode(coding, compress))
+            response.headers['Content-Encoding'] = coding
+    response.set_etag(tile.etag, weak=True)
+    response.headers['Cache-Control'] = f'public, max-age={TILE_MAX_AGE}'
+    response.vary.add('Accept-Encoding')
+    return response
+
 # API endpoint to calculate route safety score (between two points)
 # ⚠️ DEPRECATED: This version queries too many roads from Overpass API
 # Use /get_route_safety_optimized instead
@@ -811,50 +1901,17 @@ def get_route_safety_old():
     west = min_lng - lng_offset
     east = max_lng + lng_offset
     
-    # Query Overpass API for roads with retry logic
-    max_retries = 3
-    retry_delay = 2
-    result = None
-    
-    for attempt in range(max_retries):
-        try:
-            query = f"""
-            [out:json][timeout:25];
-            (
-              way["highway"]["highway"!~"motorway|motorway_link|trunk|trunk_link"]({south},{west},{north},{east});
-            );
-            out body;
-            >;
-            out skel qt;
-            """
-            print(f"Querying Overpass API for route (attempt {attempt + 1}/{max_retries})...")
-            result = overpass_api.query(query)
-            print(f"Found {len(result.ways)} road segments for route")
-            break
-        except Exception as e:
-            error_msg = str(e)
-            print(f"Overpass API error (attempt {attempt + 1}/{max_retries}): {error_msg}")
-            
-            if attempt < max_retries - 1:
-                if "load too high" in error_msg.lower() or "rate limit" in error_msg.lower():
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    return jsonify({"error": f"Overpass API error: {error_msg}"}), 500
-            else:
-                return jsonify({"error": f"Overpass API error after {max_retries} attempts: {error_msg}"}), 500
-    
-    if result is None:
-        return jsonify({"error": "Failed to query Overpass API"}), 500
+    # Get roads from the local road graph, or the Overpass tile cache
+    try:
+        road_ways = get_roads_in_bbox(south, west, north, east)
+        print(f"Found {len(road_ways)} road segments for route")
+    except Exception as e:
+        print(f"Overpass API error: {e}")
+        return jsonify({"error": f"Overpass API error: {e}"}), 500
     
     # Fetch CCTV, MRT, robbery, streetlight and police data once (with caching)
     try:
-        cctv_data = fetch_api_data_cached("d317a3c4-ff08-48af-894e-31dfb5155de3", "CCTV_DATA_CACHE")
-        mrt_data = fetch_api_data_cached("307a7f61-e302-4108-a817-877ccbfca7c1", "MRT_DATA_CACHE")
-        robbery_data = fetch_api_data_cached("6ecb4c41-fbc9-4b04-b182-a7da6c780f8d", "ROBBERY_DATA_CACHE")
-        streetlight_data = fetch_streetlight_data()
-        police_data = load_police_data()
+        layers = get_safety_layers()
     except Exception as e:
         return jsonify({"error": f"Failed to fetch safety data: {str(e)}"}), 500
     
@@ -866,9 +1923,9 @@ def get_route_safety_old():
     total_streetlight = 0
     total_police = 0
     
-    for way in result.ways:
+    for way in road_ways:
         # Get road nodes (coordinates)
-        nodes = [(float(node.lat), float(node.lon)) for node in way.nodes]
+        nodes = list(way['nodes'])
         
         if len(nodes) < 2:
             continue
@@ -878,7 +1935,7 @@ def get_route_safety_old():
         mid_lng = sum(n[1] for n in nodes) / len(nodes)
         
         # Get safety features around this segment
-        features = get_safety_features_in_radius(mid_lat, mid_lng, radius_m, cctv_data, mrt_data, robbery_data, streetlight_data, police_data)
+        features = get_safety_features_in_radius(mid_lat, mid_lng, radius_m, layers)
         
         # Count by type
         cctv_count = sum(1 for f in features if f['type'] == 'cctv')
@@ -899,8 +1956,8 @@ def get_route_safety_old():
         )
         
         road_segments.append({
-            'road_name': way.tags.get('name', 'Unknown Road'),
-            'road_type': way.tags.get('highway', 'unknown'),
+            'road_name': way['tags'].get('name', 'Unknown Road'),
+            'road_type': way['tags'].get('highway', 'unknown'),
             'nodes': nodes,
             'center': {'lat': mid_lat, 'lng': mid_lng},
             'cctv_count': cctv_count,
@@ -952,6 +2009,90 @@ def get_route_safety_old():
 
 # API endpoint to calculate route safety score (optimized version)
 
+# Analyzed /find_safe_routes results by quantized origin/destination (ROUTE_CACHE_MAX_ENTRIES=0 disables it)
+ROUTE_CACHE_TTL = int(os.environ.get('ROUTE_CACHE_TTL', 3600))
+ROUTE_CACHE_MAX_ENTRIES = int(os.environ.get('ROUTE_CACHE_MAX_ENTRIES', 1024))
+ROUTE_CACHE_PRECISION = int(os.environ.get('ROUTE_CACHE_PRECISION', 4))  # Decimals kept, 4 is about 11 m
+ROUTE_CACHE = RouteCache(ttl=ROUTE_CACHE_TTL, max_entries=ROUTE_CACHE_MAX_ENTRIES, precision=ROUTE_CACHE_PRECISION)
+
+# Threads shared by /find_safe_routes: safety data readiness next to routing, then one per analyzed route
+FIND_ROUTES_WORKERS = int(os.environ.get('FIND_ROUTES_WORKERS', 4))
+FIND_ROUTES_POOL = ThreadPoolExecutor(max_workers=FIND_ROUTES_WORKERS, thread_name_prefix='find-routes')
+
+def timed_call(func, *args, **kwargs):
+    """Run func and return (result, elapsed seconds)"""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+@timed_stage('route_analysis')
+def analyze_route(idx, route, radius_m, scoring, layers):
+    """Safety analysis of one OSRM-shaped route for /find_safe_routes"""
+    # 轉換座標格式
+    coordinates = [[coord[1], coord[0]] for coord in route['geometry']['coordinates']]
+    
+    if scoring == 'corridor':
+        # 沿路徑緩衝區計算，每個設施只算一次
+        sample_points, counts = score_route_corridor(coordinates, radius_m, layers)
+    else:
+        # 取樣點
+        if len(coordinates) <= 20:
+            sample_interval = 1
+        elif len(coordinates) <= 50:
+            sample_interval = 2
+        else:
+            sample_interval = max(2, len(coordinates) // 25)
+        
+        sample_points = coordinates[::sample_interval]
+        if coordinates[-1] not in sample_points:
+            sample_points.append(coordinates[-1])
+        
+        # 一次計算所有取樣點周圍的設施數量
+        counts = count_features_in_radius_batch(
+            [c[0] for c in sample_points], [c[1] for c in sample_points], radius_m, layers
+        )
+    
+    # 分析每個取樣點（與 /get_route_safety 相同的路段與總結格式）
+    segments = [label_segment(segment) for segment in iter_route_segments(sample_points, counts)]
+    totals = {key: sum(segment[key] for segment in segments) for key in SEGMENT_TOTAL_KEYS}
+    summary = segments_summary(totals, 'total_segments', len(segments))
+    
+    print(f"   ✅ Route {idx + 1}: {summary['label']} (score: {summary['overall_score']})")
+    
+    return {
+        'route_index': idx,
+        'is_recommended': False,  # 稍後設定
+        'geometry': coordinates,
+        'distance_m': route['distance'],
+        'duration_s': route['duration'],
+        'summary': summary,
+        'segments': segments
+    }
+
+@timed_stage('osrm_routing')
+def fetch_osrm_routes(start_lat, start_lng, end_lat, end_lng):
+    """OSRM alternatives as (routes, None), or (None, (error response, status)) on failure"""
+    osrm_url = f"https://router.project-osrm.org/route/v1/driving/{start_lng},{start_lat};{end_lng},{end_lat}"
+    params = {
+        'overview': 'full',
+        'geometries': 'geojson',
+        'alternatives': 'true',  # 請求替代路徑
+        'steps': 'false'
+    }
+    
+    print("📍 Requesting routes from OSRM...")
+    osrm_response = http_client.get(osrm_url, params=params, timeout=10)
+    
+    if osrm_response.status_code != 200:
+        return None, ({"error": "Failed to get routes from OSRM"}, 500)
+    
+    osrm_data = osrm_response.json()
+    
+    if 'routes' not in osrm_data or len(osrm_data['routes']) == 0:
+        return None, ({"error": "No routes found"}, 404)
+    
+    return osrm_data['routes'], None
+
 # API endpoint to find and compare multiple routes with safety scores
 @app.route('/find_safe_routes', methods=['POST'])
 def find_safe_routes():
@@ -959,6 +2100,7 @@ def find_safe_routes():
     找出多條路徑並比較安全性
     回傳最安全的路徑以及替代路徑
     """
+    request_start = time.time()
     data = request.get_json()
     
     start_lat = data.get('start_lat')
@@ -966,213 +2108,153 @@ def find_safe_routes():
     end_lat = data.get('end_lat')
     end_lng = data.get('end_lng')
     radius_m = data.get('radius_m', 200)
+    scoring = data.get('scoring', 'samples')
     
     if not all([start_lat, start_lng, end_lat, end_lng]):
         return jsonify({"error": "Missing coordinates"}), 400
+    if scoring not in ROUTE_SCORING_MODES:
+        return jsonify({"error": f"Invalid scoring mode, expected one of {', '.join(ROUTE_SCORING_MODES)}"}), 400
+    try:
+        response_format, simplify_m = parse_format_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        alternatives = max(1, min(int(data.get('alternatives', 3)), 5))
+    except (TypeError, ValueError):
+        return jsonify({"error": "alternatives must be an integer between 1 and 5"}), 400
     
     print(f"🔍 Finding safe routes from ({start_lat}, {start_lng}) to ({end_lat}, {end_lng})")
     
     try:
-        # 使用 OSRM 獲取多條替代路徑
-        osrm_url = f"https://router.project-osrm.org/route/v1/driving/{start_lng},{start_lat};{end_lng},{end_lat}"
-        params = {
-            'overview': 'full',
-            'geometries': 'geojson',
-            'alternatives': 'true',  # 請求替代路徑
-            'steps': 'false'
-        }
+        router = get_safe_router()
+        if router is None:
+            alternatives = None  # OSRM decides how many alternatives it returns
         
-        print("📍 Requesting routes from OSRM...")
-        osrm_response = requests.get(osrm_url, params=params, timeout=10)
-        
-        if osrm_response.status_code != 200:
-            return jsonify({"error": "Failed to get routes from OSRM"}), 500
+        # 相同起終點（量化後）與參數的結果直接從快取回傳；安全資料或路網更新後失效
+        cache_key = ROUTE_CACHE.key(start_lat, start_lng, end_lat, end_lng, radius_m, scoring, alternatives,
+                                    response_format, simplify_m)
+        cache_version = (SAFETY_DATA_VERSION, router.version if router is not None else None)
+        if ROUTE_CACHE.max_entries > 0:
+            cached = ROUTE_CACHE.get(cache_key, cache_version)
+            if cached is not None:
+                # 快取的是已序列化的結果（不含起終點與耗時），只需補上這次請求的部分
+                body = '{"end":%s,"start":%s,"timings_ms":%s,%s' % (
+                    app.json.dumps({'lat': end_lat, 'lng': end_lng}),
+                    app.json.dumps({'lat': start_lat, 'lng': start_lng}),
+                    app.json.dumps({'cache': round((time.time() - request_start) * 1000, 3)}),
+                    cached[1:]
+                )
+                return app.response_class(body, mimetype='application/json')
         
-        osrm_data = osrm_response.json()
+        # 安全資料（首次需下載）與路徑查詢同時進行
+        layers_future = FIND_ROUTES_POOL.submit(in_request_context(timed_call), get_safety_layers)
         
-        if 'routes' not in osrm_data or len(osrm_data['routes']) == 0:
-            return jsonify({"error": "No routes found"}), 404
+        # 有本機路網時直接計算考慮安全性的步行路徑，否則使用 OSRM
+        routes = None
+        routing_engine = 'osrm'
+        routing_start = time.time()
+        if router is not None:
+            routes = find_local_routes(router, start_lat, start_lng, end_lat, end_lng, k=alternatives)
+            if routes is not None:
+                routing_engine = 'local'
+                print(f"📍 Local routing: {len(routes)} route(s) in {(time.time() - routing_start) * 1000:.1f}ms")
         
-        routes = osrm_data['routes']
+        if routes is None:
+            # 使用 OSRM 獲取多條替代路徑
+            routes, error = fetch_osrm_routes(start_lat, start_lng, end_lat, end_lng)
+            if error is not None:
+                return jsonify(error[0]), error[1]
+        routing_time = time.time() - routing_start
         print(f"✅ Found {len(routes)} route(s)")
         
-        # 載入安全資料（使用快取）
-        print("🔍 Loading safety data...")
-        cctv_data = fetch_api_data_cached("d317a3c4-ff08-48af-894e-31dfb5155de3", "CCTV_DATA_CACHE")
-        mrt_data = fetch_api_data_cached("307a7f61-e302-4108-a817-877ccbfca7c1", "MRT_DATA_CACHE")
-        robbery_data = fetch_api_data_cached("6ecb4c41-fbc9-4b04-b182-a7da6c780f8d", "ROBBERY_DATA_CACHE")
-        
-        # 預先過濾路燈資料
-        all_streetlight_data = fetch_streetlight_data()
-        
-        # 計算所有路徑的邊界
-        all_lats = []
-        all_lngs = []
-        for route in routes:
-            coords = route['geometry']['coordinates']
-            all_lats.extend([c[1] for c in coords])
-            all_lngs.extend([c[0] for c in coords])
-        
-        min_lat, max_lat = min(all_lats), max(all_lats)
-        min_lng, max_lng = min(all_lngs), max(all_lngs)
-        margin = (radius_m / 111000)
-        
-        streetlight_data = [
-            item for item in all_streetlight_data
-            if (min_lat - margin <= float(item['緯度']) <= max_lat + margin and
-                min_lng - margin <= float(item['經度']) <= max_lng + margin)
-        ]
-        
-        police_data = load_police_data()
+        # 等待安全資料（使用快取，路燈等資料已建立空間索引，不需預先過濾）
+        wait_start = time.time()
+        layers, safety_data_time = layers_future.result()
+        safety_wait_time = time.time() - wait_start
         print(f"✅ Safety data loaded")
         
-        # 分析每條路徑
-        analyzed_routes = []
-        
-        for idx, route in enumerate(routes):
-            print(f"\n📊 Analyzing route {idx + 1}/{len(routes)}...")
-            
-            # 轉換座標格式
-            coordinates = [[coord[1], coord[0]] for coord in route['geometry']['coordinates']]
-            
-            # 取樣點
-            if len(coordinates) <= 20:
-                sample_interval = 1
-            elif len(coordinates) <= 50:
-                sample_interval = 2
-            else:
-                sample_interval = max(2, len(coordinates) // 25)
-            
-            sample_points = coordinates[::sample_interval]
-            if coordinates[-1] not in sample_points:
-                sample_points.append(coordinates[-1])
-            
-            # 分析每個取樣點
-            segments = []
-            total_cctv = 0
-            total_metro = 0
-            total_robbery = 0
-            total_streetlight = 0
-            total_police = 0
-            
-            for i, coord in enumerate(sample_points):
-                lat, lng = coord
-                
-                features = get_safety_features_in_radius(
-                    lat, lng, radius_m,
-                    cctv_data, mrt_data, robbery_data, streetlight_data, police_data
-                )
-                
-                cctv_count = sum(1 for f in features if f['type'] == 'cctv')
-                metro_count = sum(1 for f in features if f['type'] == 'metro')
-                robbery_count = sum(1 for f in features if f['type'] == 'robbery_incident')
-                streetlight_count = sum(1 for f in features if f['type'] == 'streetlight')
-                police_count = sum(1 for f in features if f['type'] == 'police')
-                
-                segment_score = calculate_safety_score(
-                    cctv_count=cctv_count,
-                    lamp_count=streetlight_count,
-                    mrt_count=metro_count,
-                    police_count=police_count,
-                    theft_count=0,
-                    robbery_count=robbery_count,
-                    store_count=0
-                )
-                
-                if segment_score >= 60:
-                    segment_level = 3
-                    segment_label = "安全"
-                elif segment_score >= 40:
-                    segment_level = 2
-                    segment_label = "需注意"
-                else:
-                    segment_level = 1
-                    segment_label = "危險"
-                
-                segments.append({
-                    'segment_index': i,
-                    'location': {'lat': lat, 'lng': lng},
-                    'cctv_count': cctv_count,
-                    'metro_count': metro_count,
-                    'robbery_count': robbery_count,
-                    'streetlight_count': streetlight_count,
-                    'police_count': police_count,
-                    'safety_score': segment_score,
-                    'level': segment_level,
-                    'label': segment_label
-                })
-                
-                total_cctv += cctv_count
-                total_metro += metro_count
-                total_robbery += robbery_count
-                total_streetlight += streetlight_count
-                total_police += police_count
-            
-            # 計算整體安全分數
-            overall_score = calculate_safety_score(
-                cctv_count=total_cctv,
-                lamp_count=total_streetlight,
-                mrt_count=total_metro,
-                police_count=total_police,
-                theft_count=0,
-                robbery_count=total_robbery,
-                store_count=0
-            )
-            
-            if overall_score >= 60:
-                level = 3
-                label = "安全"
-            elif overall_score >= 40:
-                level = 2
-                label = "需注意"
-            else:
-                level = 1
-                label = "危險"
-            
-            analyzed_routes.append({
-                'route_index': idx,
-                'is_recommended': False,  # 稍後設定
-                'geometry': coordinates,
-                'distance_m': route['distance'],
-                'duration_s': route['duration'],
-                'summary': {
-                    'total_segments': len(segments),
-                    'total_cctv': total_cctv,
-                    'total_metro': total_metro,
-                    'total_robbery': total_robbery,
-                    'total_streetlight': total_streetlight,
-                    'total_police': total_police,
-                    'overall_score': overall_score,
-                    'level': level,
-                    'label': label
-                },
-                'segments': segments
-            })
-            
-            print(f"   ✅ Route {idx + 1}: {label} (score: {overall_score})")
+        # 平行分析每條路徑（結果依原順序）
+        analysis_start = time.time()
+        route_futures = [
+            FIND_ROUTES_POOL.submit(in_request_context(analyze_route), idx, route, radius_m, scoring, layers)
+            for idx, route in enumerate(routes)
+        ]
+        analyzed_routes = [future.result() for future in route_futures]
+        analysis_time = time.time() - analysis_start
         
         # 找出最安全的路徑
-        best_route_idx = max(range(len(analyzed_routes)), 
+        best_route_idx = max(range(len(analyzed_routes)),
                             key=lambda i: analyzed_routes[i]['summary']['overall_score'])
         analyzed_routes[best_route_idx]['is_recommended'] = True
         
         print(f"\n🏆 Recommended route: Route {best_route_idx + 1}")
         
+        if response_format == 'compact':
+            for route in analyzed_routes:
+                route['polyline'] = compact_geometry(route.pop('geometry'), simplify_m)
+        
+        # 各階段耗時：routing 與 safety_data 同時進行，safety_data_wait 為路徑查詢後仍需等待的時間
+        timings = {
+            'routing': round(routing_time * 1000, 1),
+            'safety_data': round(safety_data_time * 1000, 1),
+            'safety_data_wait': round(safety_wait_time * 1000, 1),
+            'analysis': round(analysis_time * 1000, 1),
+            'total': round((time.time() - request_start) * 1000, 1)
+        }
+        print(f"⏱️ Timings (ms): {timings}")
+        
         response_data = {
             'start': {'lat': start_lat, 'lng': start_lng},
             'end': {'lat': end_lat, 'lng': end_lng},
             'radius_m': radius_m,
+            'scoring': scoring,
+            'routing_engine': routing_engine,
             'total_routes': len(analyzed_routes),
             'recommended_route_index': best_route_idx,
-            'routes': analyzed_routes
+            'routes': analyzed_routes,
+            'timings_ms': timings
         }
+        if response_format == 'compact':
+            response_data['format'] = 'compact'
         
+        if ROUTE_CACHE.max_entries > 0:
+            ROUTE_CACHE.put(cache_key, app.json.dumps(
+                {key: value for key, value in response_data.items() if key not in ('start', 'end', 'timings_ms')}
+            ), cache_version)
         return jsonify(response_data)
-        
+    
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def iter_route_segments(sample_points, counts):
+    """Yield the scored segment dict of every sample point (or corridor section) of a route"""
+    for i, (coord, row) in enumerate(zip(sample_points, counts.tolist())):
+        lat, lng = coord
+        cctv_count, metro_count, robbery_count, streetlight_count, police_count = row
+        
+        # Calculate segment safety score
+        segment_score = calculate_safety_score(
+            cctv_count=cctv_count,
+            lamp_count=streetlight_count,
+            mrt_count=metro_count,
+            police_count=police_count,
+            theft_count=0,
+            robbery_count=robbery_count,
+            store_count=0
+        )
+        
+        yield {
+            'segment_index': i,
+            'location': {'lat': lat, 'lng': lng},
+            'cctv_count': cctv_count,
+            'metro_count': metro_count,
+            'robbery_count': robbery_count,
+            'streetlight_count': streetlight_count,
+            'police_count': police_count,
+            'safety_score': segment_score
+        }
+
 # API endpoint to calculate route safety score (optimized version)
 # This version uses OSRM route coordinates directly, no Overpass API needed
 @app.route('/get_route_safety', methods=['POST'])
@@ -1186,179 +2268,174 @@ def get_route_safety():
     # 從前端接收 OSRM 的路徑座標
     route_coordinates = data.get('route_coordinates')  # [[lat, lng], [lat, lng], ...]
     radius_m = data.get('radius_m', 200)
+    scoring = data.get('scoring', 'samples')
     
     if not route_coordinates or len(route_coordinates) < 2:
         return jsonify({"error": "Invalid route coordinates"}), 400
+    if scoring not in ROUTE_SCORING_MODES:
+        return jsonify({"error": f"Invalid scoring mode, expected one of {', '.join(ROUTE_SCORING_MODES)}"}), 400
     
     print(f"Analyzing route with {len(route_coordinates)} points")
     
     # Fetch safety data once (with caching)
     try:
         print("Fetching safety data from Taipei APIs...")
-        cctv_data = fetch_api_data_cached("d317a3c4-ff08-48af-894e-31dfb5155de3", "CCTV_DATA_CACHE")
-        print(f"Loaded {len(cctv_data)} CCTV cameras")
-        mrt_data = fetch_api_data_cached("307a7f61-e302-4108-a817-877ccbfca7c1", "MRT_DATA_CACHE")
-        print(f"Loaded {len(mrt_data)} MRT exits")
-        robbery_data = fetch_api_data_cached("6ecb4c41-fbc9-4b04-b182-a7da6c780f8d", "ROBBERY_DATA_CACHE")
-        print(f"Loaded {len(robbery_data)} robbery incidents")
-        
-        # Pre-filter streetlights to route area
-        all_streetlight_data = fetch_streetlight_data()
-        print(f"Loaded {len(all_streetlight_data)} streetlights, filtering to route area...")
-        
-        # Calculate route bounding box
-        lats = [coord[0] for coord in route_coordinates]
-        lngs = [coord[1] for coord in route_coordinates]
-        min_lat, max_lat = min(lats), max(lats)
-        min_lng, max_lng = min(lngs), max(lngs)
-        
-        # Add margin for radius
-        margin = (radius_m / 111000)  # Rough conversion to degrees
-        streetlight_data = []
-        for item in all_streetlight_data:
-            try:
-                lat = float(item['緯度'])
-                lng = float(item['經度'])
-                if (min_lat - margin <= lat <= max_lat + margin and 
-                    min_lng - margin <= lng <= max_lng + margin):
-                    streetlight_data.append(item)
-            except (KeyError, ValueError):
-                continue
-        print(f"Filtered to {len(streetlight_data)} streetlights in route area")
-        
-        police_data = load_police_data()
-        print(f"Loaded {len(police_data)} police stations")
+        layers = get_safety_layers()
+        print(f"Loaded {len(layers['cctv'])} CCTV cameras")
+        print(f"Loaded {len(layers['metro'])} MRT exits")
+        print(f"Loaded {len(layers['robbery_incident'])} robbery incidents")
+        # Streetlights are looked up through the spatial index, no need to pre-filter to the route area
+        print(f"Loaded {len(layers['streetlight'])} streetlights")
+        print(f"Loaded {len(layers['police'])} police stations")
     except Exception as e:
         print(f"Failed to fetch safety data: {str(e)}")
         return jsonify({"error": f"Failed to fetch safety data: {str(e)}"}), 500
     
-    # 將路徑分段（取樣以提高效能）
-    if len(route_coordinates) <= 20:
-        sample_interval = 1  # 短路徑：全部計算
-    elif len(route_coordinates) <= 50:
-        sample_interval = 2  # 中等路徑：每 2 個點取 1 個
+    if scoring == 'corridor':
+        # 沿整條路徑的緩衝區計算，每個設施只算一次（歸入最近的路段）
+        sample_points, counts = score_route_corridor(route_coordinates, radius_m, layers)
+        print(f"Scored route corridor in {len(sample_points)} sections")
     else:
-        sample_interval = max(2, len(route_coordinates) // 25)  # 長路徑：最多 25 個取樣點
-    
-    sample_points = route_coordinates[::sample_interval]
-    
-    # 確保終點被包含
-    if route_coordinates[-1] not in sample_points:
-        sample_points.append(route_coordinates[-1])
-    
-    print(f"Sampling {len(sample_points)} points from route (interval: {sample_interval})")
-    
-    # 對每個取樣點計算周圍的安全資源
-    route_segments = []
-    total_cctv = 0
-    total_metro = 0
-    total_robbery = 0
-    total_streetlight = 0
-    total_police = 0
-    
-    for i, coord in enumerate(sample_points):
-        lat, lng = coord
-        
-        # Get safety features around this point
-        features = get_safety_features_in_radius(
-            lat, lng, radius_m, 
-            cctv_data, mrt_data, robbery_data, streetlight_data, police_data
-        )
-        
-        # Count by type
-        cctv_count = sum(1 for f in features if f['type'] == 'cctv')
-        metro_count = sum(1 for f in features if f['type'] == 'metro')
-        robbery_count = sum(1 for f in features if f['type'] == 'robbery_incident')
-        streetlight_count = sum(1 for f in features if f['type'] == 'streetlight')
-        police_count = sum(1 for f in features if f['type'] == 'police')
+        # 將路徑分段（取樣以提高效能）
+        if len(route_coordinates) <= 20:
+            sample_interval = 1  # 短路徑：全部計算
+        elif len(route_coordinates) <= 50:
+            sample_interval = 2  # 中等路徑：每 2 個點取 1 個
+        else:
+            sample_interval = max(2, len(route_coordinates) // 25)  # 長路徑：最多 25 個取樣點
         
-        # Calculate segment safety score
-        segment_score = calculate_safety_score(
-            cctv_count=cctv_count,
-            lamp_count=streetlight_count,
-            mrt_count=metro_count,
-            police_count=police_count,
-            theft_count=0,
-            robbery_count=robbery_count,
-            store_count=0
-        )
+        sample_points = route_coordinates[::sample_interval]
         
-        # Determine segment level and label
-        if segment_score >= 60:
-            segment_level = 3
-            segment_label = "安全"
-        elif segment_score >= 40:
-            segment_level = 2
-            segment_label = "需注意"
-        else:
-            segment_level = 1
-            segment_label = "危險"
+        # 確保終點被包含
+        if route_coordinates[-1] not in sample_points:
+            sample_points.append(route_coordinates[-1])
         
-        route_segments.append({
-            'segment_index': i,
-            'location': {'lat': lat, 'lng': lng},
-            'cctv_count': cctv_count,
-            'metro_count': metro_count,
-            'robbery_count': robbery_count,
-            'streetlight_count': streetlight_count,
-            'police_count': police_count,
-            'safety_score': segment_score,
-            'level': segment_level,
-            'label': segment_label
-        })
+        print(f"Sampling {len(sample_points)} points from route (interval: {sample_interval})")
         
-        total_cctv += cctv_count
-        total_metro += metro_count
-        total_robbery += robbery_count
-        total_streetlight += streetlight_count
-        total_police += police_count
-    
-    # Calculate overall route safety score
-    overall_score = calculate_safety_score(
-        cctv_count=total_cctv,
-        lamp_count=total_streetlight,
-        mrt_count=total_metro,
-        police_count=total_police,
-        theft_count=0,
-        robbery_count=total_robbery,
-        store_count=0
-    )
-    
-    # Determine level and label
-    if overall_score >= 60:
-        level = 3
-        label = "安全"
-    elif overall_score >= 40:
-        level = 2
-        label = "需注意"
-    else:
-        level = 1
-        label = "危險"
-    
-    print(f"Route analysis complete: score={overall_score}, level={label}")
+        # Count safety features around all sample points in one batch
+        counts = count_features_in_radius_batch(
+            [c[0] for c in sample_points], [c[1] for c in sample_points], radius_m, layers
+        )
     
-    # Construct response
-    response_data = {
+    route_fields = {
         'route': {
             'total_points': len(route_coordinates),
             'sampled_points': len(sample_points),
-            'radius_m': radius_m
-        },
-        'summary': {
-            'total_segments': len(route_segments),
-            'total_cctv': total_cctv,
-            'total_metro': total_metro,
-            'total_robbery': total_robbery,
-            'total_streetlight': total_streetlight,
-            'total_police': total_police,
-            'overall_score': overall_score,
-            'level': level,
-            'label': label
-        },
-        'segments': route_segments
+            'radius_m': radius_m,
+            'scoring': scoring
+        }
     }
+    segments = iter_route_segments(sample_points, counts)
+    if wants_stream(data.get('stream', False)):
+        return stream_segments(segments, 'segment', 'total_segments', route_fields)
+    
+    # 對每個取樣點（或路段）計算周圍的安全資源
+    route_segments = [label_segment(segment) for segment in segments]
+    totals = {key: sum(segment[key] for segment in route_segments) for key in SEGMENT_TOTAL_KEYS}
+    summary = segments_summary(totals, 'total_segments', len(route_segments))
+    
+    print(f"Route analysis complete: score={summary['overall_score']}, level={summary['label']}")
+    
+    # Construct response
+    response_data = dict(route_fields, summary=summary, segments=route_segments)
     
     return jsonify(response_data)
 
+# Hit/miss counters of the in-process caches
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'route_cache': ROUTE_CACHE.stats(),
+        'road_tile_cache': ROAD_CACHE.stats(),
+        'tile_cache': TILE_CACHE.stats()
+    })
+
+# Every dataset manager by name, for the dataset metrics
+def dataset_managers():
+    return dict(SAFETY_DATASETS, road_graph=ROAD_GRAPH_DATASET, road_scores=ROAD_SCORES_DATASET)
+
+def dataset_metric(read):
+    """Callback metric values: read(manager) per dataset, skipping None"""
+    def collect():
+        values = ((name, read(manager)) for name, manager in dataset_managers().items())
+        return [((name,), value) for name, value in values if value is not None]
+    return collect
+
+RESPONSE_CACHES = {'route': ROUTE_CACHE, 'tile': TILE_CACHE, 'road_tile': ROAD_CACHE}
+
+def cache_metric(*keys):
+    """Callback metric values: the first of `keys` present in each response cache's stats()"""
+    def collect():
+        values = []
+        for name, cache in RESPONSE_CACHES.items():
+            stats = cache.stats()
+            values.append(((name,), next(stats[key] for key in keys if key in stats)))
+        return values
+    return collect
+
+METRICS.callback('backend_cache_hits_total', 'Response cache hits', ('cache',), cache_metric('hits'), type='counter')
+METRICS.callback('backend_cache_misses_total', 'Response cache misses', ('cache',), cache_metric('misses'), type='counter')
+METRICS.callback('backend_cache_entries', 'Entries held by each response cache', ('cache',), cache_metric('entries', 'tiles'))
+METRICS.callback('backend_dataset_hits_total', 'Dataset reads served from the loaded value', ('dataset',),
+                 dataset_metric(lambda manager: manager.hits), type='counter')
+METRICS.callback('backend_dataset_misses_total', 'Dataset reads that waited for a cold load', ('dataset',),
+                 dataset_metric(lambda manager: manager.misses), type='counter')
+METRICS.callback('backend_dataset_age_seconds', 'Age of the loaded value of each dataset', ('dataset',),
+                 dataset_metric(lambda manager: manager.age()))
+METRICS.callback('backend_dataset_loaded', 'Whether each dataset has a value loaded (1) or not (0)', ('dataset',),
+                 dataset_metric(lambda manager: int(manager.peek() is not None)))
+METRICS.callback('backend_dataset_load_duration_seconds', 'Duration of the last successful load of each dataset',
+                 ('dataset',), dataset_metric(lambda manager: manager.last_load_seconds))
+METRICS.callback('backend_dataset_loads_total', 'Successful loads of each dataset', ('dataset',),
+                 dataset_metric(lambda manager: manager.loads), type='counter')
+METRICS.callback('backend_dataset_load_failures_total', 'Failed loads of each dataset', ('dataset',),
+                 dataset_metric(lambda manager: manager.load_failures), type='counter')
+METRICS.callback('backend_safety_data_version', 'Safety layer version, bumped on every layer swap', (),
+                 lambda: [((), SAFETY_DATA_VERSION)])
+METRICS.callback('backend_upstream_circuit_open', 'Whether the circuit breaker of an upstream host is open (1) or not (0)',
+                 ('upstream',),
+                 lambda: [((UPSTREAM_NAMES.get(urllib.parse.urlsplit(host).netloc, host),), int(stats['state'] == 'open'))
+                          for host, stats in http_client.stats().items()])
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class(METRICS.render(), content_type=METRICS.content_type)
+
+# Profiles captured with ?profile=1, for PROFILE_TOKEN holders only
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    if not PROFILE_TOKEN:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    if not profile_authorized():
+        return jsonify({"error": "Invalid profile token"}), 401
+    return jsonify({'profiles': PROFILES.list()})
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    if not PROFILE_TOKEN:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    if not profile_authorized():
+        return jsonify({"error": "Invalid profile token"}), 401
+    if request.args.get('format') == 'text':
+        # Top functions by cumulative time (or ?sort=tottime etc.)
+        try:
+            text = PROFILES.text(profile_id, sort=request.args.get('sort', 'cumulative'),
+                                 limit=int(request.args.get('limit', 40)))
+        except (KeyError, ValueError) as e:
+            return jsonify({"error": f"Invalid sort or limit: {e}"}), 400
+        if text is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return app.response_class(text, mimetype='text/plain')
+    data = PROFILES.data(profile_id)
+    if data is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return app.response_class(data, mimetype='application/octet-stream',
+                              headers={'Content-Disposition': f'attachment; filename={profile_id}.prof'})
+
 if __name__ == '__main__':
+    # With the debug reloader only the child process serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_start_from_snapshot()
+        get_road_graph()
     app.run(debug=True, port=5001)
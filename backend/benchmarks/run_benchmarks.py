@@ -0,0 +1,239 @@
+"""
+Microbenchmarks of the backend hot paths and endpoint handlers on synthetic Taipei-scale
+data (145k streetlights, 13k CCTV, MRT exits, robberies, police.ods), with every upstream
+call answered locally by benchmarks/synthetic.py.
+
+    python benchmarks/run_benchmarks.py [--output results.json] [--filter endpoint]
+    python benchmarks/run_benchmarks.py --save-baseline          # record benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json [--threshold 0.2]
+
+Results are JSON (seconds per call: median, min, mean, stdev). With a baseline, every
+benchmark whose median is more than `threshold` slower is reported and the exit status
+is 1. Baselines are only comparable on the machine that recorded them.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+# Measure computation, not the response caches, snapshots or files of a local install
+BENCHMARK_ENV = {
+    'SAFETY_SNAPSHOT_PATH': '',
+    'ROAD_SCORES_PATH': '',
+    'OSM_EXTRACT_PATH': '',
+    'ROUTE_CACHE_MAX_ENTRIES': '0',
+    'TILE_CACHE_MAX_ENTRIES': '0',
+}
+
+
+def time_call(func, repeat, min_time):
+    """Seconds per call of func: timeit-style autorange to about min_time per round, `repeat` rounds"""
+    timer = timeit.Timer(func)
+    func()  # Warm up caches, lazy imports and indexes
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    rounds = [elapsed / number] + [timer.timeit(number) / number for _ in range(repeat - 1)]
+    return {
+        'median_s': statistics.median(rounds),
+        'min_s': min(rounds),
+        'mean_s': statistics.mean(rounds),
+        'stdev_s': statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+        'number': number,
+        'repeat': len(rounds),
+    }
+
+
+def setup_backend():
+    """Import the backend against the synthetic upstreams and load every layer"""
+    for key, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(key, value)
+    os.chdir(BACKEND_DIR)  # police.ods is read relative to the backend directory
+    sys.path.insert(0, BACKEND_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import backend
+    import synthetic
+
+    upstreams = synthetic.SyntheticUpstreams()
+    upstreams.install(backend)
+    layers = backend.get_safety_layers()
+    return backend, synthetic, layers
+
+
+def define_benchmarks(backend, synthetic, layers):
+    """name -> zero-argument callable"""
+    import numpy as np
+
+    points = synthetic.query_points(1000)
+    lats = np.array([p[0] for p in points])
+    lngs = np.array([p[1] for p in points])
+    cursor = {'i': 0}
+
+    def next_point():
+        cursor['i'] = (cursor['i'] + 1) % len(points)
+        return points[cursor['i']]
+
+    xs = np.linspace(296000, 312000, 1000)
+    ys = np.linspace(2762000, 2780000, 1000)
+    score_inputs = np.random.RandomState(synthetic.SEED).randint(0, 60, (5, 10000))
+    center_lat, center_lng = synthetic.CENTER
+    route = synthetic.route_coordinates((center_lat - 0.012, center_lng - 0.01), (center_lat + 0.012, center_lng + 0.01))
+    batch = {'queries': [{'lat': lat, 'lng': lng} for lat, lng in points[:200]], 'radius_m': 200}
+    route_body = {'start_lat': center_lat - 0.012, 'start_lng': center_lng - 0.01,
+                  'end_lat': center_lat + 0.012, 'end_lng': center_lng + 0.01}
+    client = backend.app.test_client()
+
+    def get(url):
+        def call():
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            return response.data
+        return call
+
+    def post(url, body):
+        def call():
+            response = client.post(url, json=body)
+            assert response.status_code == 200, (url, response.status_code)
+            return response.data
+        return call
+
+    def get_safety_data(radius_param=''):
+        def call():
+            lat, lng = next_point()
+            return get(f'/get_safety_data?center_lat={lat}&center_lng={lng}{radius_param}')()
+        return call
+
+    tile_x, tile_y = 54893, 28057  # z16 tile around the center
+    return {
+        # Coordinate conversion and distance
+        'twd97_to_wgs84': lambda: backend.twd97_to_wgs84(304000.0, 2771000.0),
+        'twd97_to_wgs84_array_1k': lambda: backend.twd97_to_wgs84_array(xs, ys),
+        'haversine': lambda: backend.haversine(center_lat, center_lng, 25.05, 121.54),
+        'haversine_np_1k': lambda: backend.haversine_np(center_lat, center_lng, lats, lngs),
+        # Scoring
+        'calculate_safety_score': lambda: backend.calculate_safety_score(
+            cctv_count=12, lamp_count=40, mrt_count=2, police_count=1, theft_count=0, robbery_count=3, store_count=0),
+        'calculate_safety_score_array_10k': lambda: backend.calculate_safety_score_array(*score_inputs),
+        # Feature lookups against the full layers
+        'get_safety_features_in_radius_500m': lambda: backend.get_safety_features_in_radius(*next_point(), 500, layers),
+        'count_features_in_radius_batch_1k': lambda: backend.count_features_in_radius_batch(lats, lngs, 200, layers),
+        'count_features_along_route': lambda: backend.count_features_along_route(
+            [c[0] for c in route], [c[1] for c in route], 200, layers),
+        # Dataset loads (parsing and conversion, upstreams answered locally)
+        'load_streetlight_layer': backend.load_streetlight_layer,
+        'load_cctv_layer': lambda: backend.load_api_layer('cctv'),
+        'load_police_layer': backend.load_police_layer,
+        # Endpoint handlers through the Flask test client
+        'endpoint_get_safety_data': get_safety_data('&radius_m=500'),
+        'endpoint_get_safety_data_default_radius': get_safety_data(),  # radius_m omitted: the most called path
+        'endpoint_get_nearest_facilities': get(f'/get_nearest_facilities?center_lat={center_lat}&center_lng={center_lng}&type=police&k=5'),
+        'endpoint_get_safety_data_batch_200': post('/get_safety_data_batch', batch),
+        'endpoint_get_nearby_roads_safety_500m': get(f'/get_nearby_roads_safety?center_lat={center_lat}&center_lng={center_lng}&search_radius_m=500'),
+        'endpoint_get_route_safety': post('/get_route_safety', {'route_coordinates': route}),
+        'endpoint_get_route_safety_corridor': post('/get_route_safety', {'route_coordinates': route, 'scoring': 'corridor'}),
+        'endpoint_get_route_safety_old': get(f'/get_route_safety_old?start_lat={center_lat}&start_lng={center_lng}'
+                                             f'&end_lat={center_lat + 0.004}&end_lng={center_lng + 0.004}'),
+        'endpoint_find_safe_routes': post('/find_safe_routes', route_body),
+        'endpoint_tile_z16': get(f'/tiles/16/{tile_x}/{tile_y}'),
+        'endpoint_metrics': get('/metrics'),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Rows (name, baseline median, current median, ratio, regressed) of the benchmarks in both runs"""
+    rows = []
+    for name, result in results['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is None:
+            continue
+        ratio = result['median_s'] / base['median_s'] if base['median_s'] > 0 else float('inf')
+        rows.append((name, base['median_s'], result['median_s'], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f'{seconds:.2f}s'
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:.2f}ms'
+    return f'{seconds * 1e6:.1f}µs'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend hot paths on synthetic Taipei-scale data")
+    parser.add_argument('--output', help="Write the results JSON here (default: print it)")
+    parser.add_argument('--baseline', help="Compare against this results file and exit 1 on regressions")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Also write the results to {DEFAULT_BASELINE}")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown of the median (0.2 = 20%%)")
+    parser.add_argument('--filter', default='', help="Only run benchmarks whose name contains this")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed rounds per benchmark")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds per round to calibrate the call count to")
+    args = parser.parse_args()
+
+    # The backend logs every request; keep it out of the report
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        with contextlib.redirect_stdout(devnull):
+            backend, synthetic, layers = setup_backend()
+        print(f"Setup (synthetic data, layers) in {time.time() - start:.1f}s", file=sys.stderr)
+
+        benchmarks = define_benchmarks(backend, synthetic, layers)
+        results = {
+            'meta': {
+                'created_at': time.time(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'layer_sizes': {feature_type: len(layer) for feature_type, layer in layers.items()},
+            },
+            'benchmarks': {},
+        }
+        for name, func in benchmarks.items():
+            if args.filter not in name:
+                continue
+            with contextlib.redirect_stdout(devnull):
+                result = time_call(func, args.repeat, args.min_time)
+            results['benchmarks'][name] = result
+            print(f"{name:42s} {format_seconds(result['median_s']):>10s}  (±{format_seconds(result['stdev_s'])}, "
+                  f"{result['number']} calls x {result['repeat']})", file=sys.stderr)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, 'w') as f:
+            f.write(text + '\n')
+        print(f"Saved baseline to {DEFAULT_BASELINE}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.threshold)
+        regressions = [row for row in rows if row[4]]
+        print(f"\nCompared {len(rows)} benchmarks with {args.baseline} (threshold +{args.threshold:.0%}):", file=sys.stderr)
+        for name, base, current, ratio, regressed in rows:
+            flag = 'REGRESSION' if regressed else ('faster' if ratio < 1 - args.threshold else '')
+            print(f"  {name:42s} {format_seconds(base):>10s} -> {format_seconds(current):>10s}  x{ratio:.2f} {flag}",
+                  file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} regression(s)", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Deterministic synthetic Taipei-scale datasets and a stand-in for every upstream the backend
+calls (data.taipei, blob storage, NLSC, OSRM, Overpass), so benchmarks run offline and
+always see the same data.
+"""
+import json
+import math
+import re
+from urllib.parse import urlsplit
+
+import numpy as np
+
+SEED = 20240601
+
+# Production dataset sizes
+STREETLIGHT_COUNT = 145000
+CCTV_COUNT = 13000
+MRT_STATION_COUNT = 120
+MRT_EXITS_PER_STATION = 4
+ROBBERY_COUNT = 3000
+
+# Taipei city area: TWD97 box for the streetlights, and about the same box in WGS84
+TWD97_BOUNDS = (296000.0, 2762000.0, 312000.0, 2780000.0)  # (min x, min y, max x, max y)
+WGS84_BOUNDS = (24.966, 121.456, 25.127, 121.614)  # (south, west, north, east)
+CENTER = (25.046, 121.535)
+
+CCTV_RESOURCE_ID = "d317a3c4-ff08-48af-894e-31dfb5155de3"
+MRT_RESOURCE_ID = "307a7f61-e302-4108-a817-877ccbfca7c1"
+ROBBERY_RESOURCE_ID = "6ecb4c41-fbc9-4b04-b182-a7da6c780f8d"
+
+ROAD_SPACING_DEG = 0.0015  # Synthetic street grid for Overpass: about 150 m blocks
+
+
+def _uniform_points(rng, count, bounds=WGS84_BOUNDS):
+    south, west, north, east = bounds
+    return rng.uniform(south, north, count), rng.uniform(west, east, count)
+
+
+def make_streetlights(rng, count=STREETLIGHT_COUNT):
+    """Blob storage TaipeiLight.json rows: TWD97 coordinates as strings"""
+    min_x, min_y, max_x, max_y = TWD97_BOUNDS
+    xs = rng.uniform(min_x, max_x, count)
+    ys = rng.uniform(min_y, max_y, count)
+    return [{'SerialNumber': f'L{i:06d}', 'TWD97X': f'{x:.2f}', 'TWD97Y': f'{y:.2f}'}
+            for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist()))]
+
+
+def make_cctv(rng, count=CCTV_COUNT):
+    lats, lngs = _uniform_points(rng, count)
+    return [{'攝影機編號': f'CAM{i:05d}', 'wgsy': f'{lat:.6f}', 'wgsx': f'{lng:.6f}', '電話': ''}
+            for i, (lat, lng) in enumerate(zip(lats.tolist(), lngs.tolist()))]
+
+
+def make_mrt_exits(rng, stations=MRT_STATION_COUNT, exits=MRT_EXITS_PER_STATION):
+    """Exits clustered within about 80 m of each station"""
+    station_lats, station_lngs = _uniform_points(rng, stations)
+    rows = []
+    for s, (lat, lng) in enumerate(zip(station_lats.tolist(), station_lngs.tolist())):
+        offsets = rng.uniform(-0.0008, 0.0008, (exits, 2))
+        for e, (dlat, dlng) in enumerate(offsets.tolist()):
+            rows.append({'出入口名稱': f'站{s:03d}出口{e + 1}', '緯度': f'{lat + dlat:.6f}', '經度': f'{lng + dlng:.6f}'})
+    return rows
+
+
+def make_robberies(rng, count=ROBBERY_COUNT):
+    lats, lngs = _uniform_points(rng, count)
+    days = rng.randint(0, 365, count).tolist()
+    return [{'緯度': f'{lat:.6f}', '經度': f'{lng:.6f}', '發生日期': f'2024-{day // 31 + 1:02d}-{day % 28 + 1:02d}',
+             '發生時段': f'{(day % 12) * 2:02d}-{(day % 12) * 2 + 2:02d}', '發生地點': f'地點{i}'}
+            for i, (lat, lng, day) in enumerate(zip(lats.tolist(), lngs.tolist(), days))]
+
+
+def query_points(count, spread_deg=0.03, seed=SEED + 1):
+    """Deterministic query locations around the city center"""
+    rng = np.random.RandomState(seed)
+    lats = CENTER[0] + rng.uniform(-spread_deg, spread_deg, count)
+    lngs = CENTER[1] + rng.uniform(-spread_deg, spread_deg, count)
+    return list(zip(lats.tolist(), lngs.tolist()))
+
+
+def route_coordinates(start, end, points=120, bend=0.0):
+    """[[lat, lng], ...] from start to end, bowed sideways by `bend` degrees in the middle"""
+    coords = []
+    for i in range(points):
+        f = i / (points - 1)
+        coords.append([start[0] + (end[0] - start[0]) * f,
+                       start[1] + (end[1] - start[1]) * f + bend * 4 * f * (1 - f)])
+    return coords
+
+
+def overpass_roads(south, west, north, east, spacing=ROAD_SPACING_DEG):
+    """Overpass JSON of a street grid: an east-west and a north-south way per grid node in the bbox"""
+    elements = []
+    nodes = {}
+
+    def node_id(row, col):
+        key = (row, col)
+        if key not in nodes:
+            nodes[key] = len(nodes) + 1
+            elements.append({'type': 'node', 'id': nodes[key], 'lat': row * spacing, 'lon': col * spacing})
+        return nodes[key]
+
+    for row in range(math.floor(south / spacing), math.floor(north / spacing) + 1):
+        for col in range(math.floor(west / spacing), math.floor(east / spacing) + 1):
+            way_id = row * 1000000 + col
+            elements.append({'type': 'way', 'id': way_id * 2, 'nodes': [node_id(row, col), node_id(row, col + 1)],
+                             'tags': {'name': f'東西路{way_id}', 'highway': 'residential'}})
+            elements.append({'type': 'way', 'id': way_id * 2 + 1, 'nodes': [node_id(row, col), node_id(row + 1, col)],
+                             'tags': {'name': f'南北路{way_id}', 'highway': 'secondary'}})
+    return {'version': 0.6, 'elements': elements}
+
+
+class SyntheticResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self._payload = payload
+        self.content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.headers = {'Content-Type': 'application/json'}
+
+    def json(self):
+        return self._payload
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+
+class SyntheticUpstreams:
+    """
+    Answers the backend's outbound calls from the synthetic datasets. Install it with
+    install(backend) so every HttpClient session returns this object.
+    """
+
+    def __init__(self, seed=SEED, streetlights=STREETLIGHT_COUNT, cctv=CCTV_COUNT, robberies=ROBBERY_COUNT):
+        rng = np.random.RandomState(seed)
+        self.streetlights = make_streetlights(rng, streetlights)
+        self.datasets = {
+            CCTV_RESOURCE_ID: make_cctv(rng, cctv),
+            MRT_RESOURCE_ID: make_mrt_exits(rng),
+            ROBBERY_RESOURCE_ID: make_robberies(rng, robberies),
+        }
+        self.calls = 0
+
+    def install(self, backend):
+        backend.http_client.session = lambda url: self
+
+    def request(self, method, url, params=None, data=None, timeout=None, **kwargs):
+        self.calls += 1
+        host = urlsplit(url).netloc
+        if host == 'data.taipei':
+            rows = self.datasets[params['resource_id']]
+            offset, limit = int(params.get('offset', 0)), int(params.get('limit', 1000))
+            return SyntheticResponse({'result': {'count': len(rows), 'results': rows[offset:offset + limit]}})
+        if 'TaipeiLight' in url:
+            return SyntheticResponse(self.streetlights)
+        if '/route/v1/' in url:
+            return SyntheticResponse(self._osrm_routes(url))
+        if method == 'POST' and data is not None:
+            # Overpass QL query with one (south,west,north,east) bbox
+            bbox = re.search(r'\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)', data.decode('utf-8'))
+            return SyntheticResponse(overpass_roads(*map(float, bbox.groups())))
+        if host == 'api.nlsc.gov.tw':
+            return SyntheticResponse([{'x': '304000', 'y': '2771000'}])
+        return SyntheticResponse({'error': f'no synthetic data for {url}'}, 404)
+
+    def _osrm_routes(self, url):
+        """Three alternatives between the two waypoints of an OSRM route URL"""
+        waypoints = urlsplit(url).path.split('/driving/')[1].split(';')
+        (lng1, lat1), (lng2, lat2) = [tuple(map(float, point.split(','))) for point in waypoints]
+        routes = []
+        for k in range(3):
+            coords = route_coordinates((lat1, lng1), (lat2, lng2), points=300, bend=0.002 * k)
+            routes.append({'geometry': {'type': 'LineString', 'coordinates': [[lng, lat] for lat, lng in coords]},
+                           'distance': 3000.0 + 150 * k, 'duration': 2300.0 + 110 * k})
+        return {'code': 'Ok', 'routes': routes}
@@ -0,0 +1,115 @@
+import threading
+import time
+
+
+class DatasetManager:
+    """
+    Holds the current value of one dataset and refreshes it stale-while-revalidate.
+
+    - get() returns the current value immediately; once it is older than ttl a single
+      background refresh is started and the old value keeps being served meanwhile.
+    - The value and its load time are swapped in as one tuple, so readers always see a
+      consistent pair. Values are treated as immutable: a refresh builds a new one.
+    - Concurrent cold loads (no value yet) are collapsed into one call of the loader;
+      the other callers wait for it and get the same value (or the same error).
+    - A failed background refresh keeps the old value and is retried on the next get().
+    """
+
+    def __init__(self, name, loader, ttl=None, on_update=None):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl  # None: never refresh automatically
+        self.on_update = on_update
+        self._state = (None, None)  # (value, loaded_at)
+        self._lock = threading.Lock()
+        self._cold_load = None  # Event of the in-flight cold load
+        self._cold_error = None
+        self._refreshing = False
+        self.last_load_seconds = None  # Wall time of the last successful load
+        self.hits = 0  # get() calls served from the current value
+        self.misses = 0  # get() calls that had to wait for a cold load
+        self.loads = 0
+        self.load_failures = 0
+
+    def get(self):
+        value, loaded_at = self._state
+        if value is None:
+            self.misses += 1
+            return self._load_cold()
+        self.hits += 1
+        if self.ttl is not None and time.time() - loaded_at >= self.ttl:
+            self.refresh_async()
+        return value
+
+    def peek(self):
+        """Current value without loading or refreshing (None if never loaded)"""
+        return self._state[0]
+
+    def age(self):
+        loaded_at = self._state[1]
+        return None if loaded_at is None else time.time() - loaded_at
+
+    def set(self, value, loaded_at=None):
+        self._state = (value, time.time() if loaded_at is None else loaded_at)
+        if self.on_update is not None:
+            self.on_update(self.name, value)
+
+    def _load(self):
+        start = time.time()
+        try:
+            value = self.loader()
+        except Exception:
+            self.load_failures += 1
+            raise
+        self.loads += 1
+        self.last_load_seconds = time.time() - start
+        print(f"Loaded {self.name} in {self.last_load_seconds:.2f}s")
+        return value
+
+    def _load_cold(self):
+        with self._lock:
+            value = self._state[0]
+            if value is not None:
+                return value
+            leader = self._cold_load is None
+            if leader:
+                self._cold_load = threading.Event()
+                self._cold_error = None
+            event = self._cold_load
+
+        if not leader:
+            event.wait()
+            value = self._state[0]
+            if value is None:
+                raise self._cold_error or Exception(f"Failed to load {self.name}")
+            return value
+
+        try:
+            value = self._load()
+            self.set(value)
+            return value
+        except Exception as e:
+            self._cold_error = e
+            raise
+        finally:
+            with self._lock:
+                self._cold_load = None
+            event.set()
+
+    def refresh_async(self):
+        """Start a background refresh unless one is already running"""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True, name=f"refresh-{self.name}").start()
+        return True
+
+    def _refresh(self):
+        try:
+            self.set(self._load())
+        except Exception as e:
+            print(f"Background refresh of {self.name} failed, still serving the previous data: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
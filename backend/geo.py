@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+
+
+# Vectorized haversine: lat2/lon2 (or both points) may be NumPy arrays, result in meters
+def haversine_np(lat1, lon1, lat2, lon2):
+    R = 6371000  # Earth radius in meters
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    delta_phi = np.radians(np.subtract(lat2, lat1))
+    delta_lambda = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(delta_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+
+# Distance in meters from points (arrays of shape P) to segments (arrays of shape S), as a P x S
+# matrix. Uses a local equirectangular projection around ref_lat, accurate at city scale.
+def point_segment_distances_np(lats, lngs, lat1, lng1, lat2, lng2, ref_lat):
+    meters_per_deg = 6371000 * np.pi / 180
+    kx = meters_per_deg * np.cos(np.radians(ref_lat))
+    px = np.asarray(lngs)[:, None] * kx
+    py = np.asarray(lats)[:, None] * meters_per_deg
+    ax = np.asarray(lng1)[None, :] * kx
+    ay = np.asarray(lat1)[None, :] * meters_per_deg
+    dx = np.asarray(lng2)[None, :] * kx - ax
+    dy = np.asarray(lat2)[None, :] * meters_per_deg - ay
+    length2 = dx * dx + dy * dy
+    # Position of the closest point along each segment, 0..1 (0 for zero-length segments)
+    t = np.clip(((px - ax) * dx + (py - ay) * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+# Douglas-Peucker simplification of [[lat, lng], ...]: drop points closer than tolerance_m to the
+# line through the points kept around them. The first and last points are always kept.
+def simplify_polyline(points, tolerance_m):
+    if tolerance_m <= 0 or len(points) < 3:
+        return list(points)
+    lats = np.array([p[0] for p in points], dtype=np.float64)
+    lngs = np.array([p[1] for p in points], dtype=np.float64)
+    ref_lat = lats.mean()
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = point_segment_distances_np(lats[first + 1:last], lngs[first + 1:last],
+                                               lats[first:first + 1], lngs[first:first + 1],
+                                               lats[last:last + 1], lngs[last:last + 1], ref_lat)[:, 0]
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return [points[i] for i in np.flatnonzero(keep).tolist()]
+
+
+# Encoded polyline (Google polyline algorithm, lat/lng order as used by OSRM) of [[lat, lng], ...]
+def encode_polyline(points, precision=5):
+    factor = 10 ** precision
+    chunks = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        lat_e5 = int(math.floor(lat * factor + 0.5))
+        lng_e5 = int(math.floor(lng * factor + 0.5))
+        for delta in (lat_e5 - prev_lat, lng_e5 - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        prev_lat, prev_lng = lat_e5, lng_e5
+    return ''.join(chunks)
+
+
+# (south, west, north, east) in degrees of web-mercator (XYZ / slippy map) tile z/x/y
+def tile_bounds(z, x, y):
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+# Parts of the polyline [[lat, lng], ...] inside the bbox (Liang-Barsky per segment). Segments are
+# clipped in lat/lng space, which is indistinguishable from mercator at tile scale.
+def clip_polyline(points, south, west, north, east):
+    parts = []
+    current = []
+    for (lat1, lng1), (lat2, lng2) in zip(points, points[1:]):
+        dlat = lat2 - lat1
+        dlng = lng2 - lng1
+        t0, t1 = 0.0, 1.0
+        for p, q in ((-dlng, lng1 - west), (dlng, east - lng1), (-dlat, lat1 - south), (dlat, north - lat1)):
+            if p == 0:
+                if q < 0:
+                    t0, t1 = 1.0, 0.0
+                    break
+            elif p < 0:
+                t0 = max(t0, q / p)
+            else:
+                t1 = min(t1, q / p)
+        if t0 > t1:
+            if len(current) > 1:
+                parts.append(current)
+            current = []
+            continue
+        start = [lat1 + t0 * dlat, lng1 + t0 * dlng] if t0 > 0 else [lat1, lng1]
+        end = [lat1 + t1 * dlat, lng1 + t1 * dlng] if t1 < 1 else [lat2, lng2]
+        if not current or t0 > 0:
+            # The previous part left the bbox (or this is the first visible segment)
+            if len(current) > 1:
+                parts.append(current)
+            current = [start]
+        current.append(end)
+        if t1 < 1:
+            parts.append(current)
+            current = []
+    if len(current) > 1:
+        parts.append(current)
+    return parts
@@ -0,0 +1,149 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeout used when a call does not pass its own
+DEFAULT_TIMEOUT = (3.05, 30)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the upstream's circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Per-upstream failure counter.
+    After failure_threshold consecutive failures the circuit opens and calls fail fast for
+    reset_timeout seconds; then one trial call is let through (half-open) and its result
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self.trial_running = False
+
+
+class HttpClient:
+    """
+    Shared outbound HTTP client: one keep-alive requests.Session per upstream host (so TCP
+    and TLS connections are reused across requests and threads), a default timeout on every
+    call and a circuit breaker per host. Connection errors, timeouts, 429 and 5xx responses
+    count as failures; other responses are returned to the caller as they are.
+
+    on_request(url, seconds, status_code, error), if given, is called after every call
+    (status_code None when it raised, error None when a response came back).
+    """
+
+    def __init__(self, pool_maxsize=16, timeout=DEFAULT_TIMEOUT, failure_threshold=5, reset_timeout=30,
+                 on_request=None):
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_request = on_request
+        self._sessions = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def session(self, url):
+        host = self._host(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def breaker(self, url):
+        host = self._host(url)
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+            return breaker
+
+    def request(self, method, url, timeout=None, **kwargs):
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            error = CircuitOpenError(f"{self._host(url)} is unavailable (circuit open)")
+            self._report(url, 0.0, None, error)
+            raise error
+        start = time.time()
+        try:
+            response = self.session(url).request(method, url, timeout=timeout or self.timeout, **kwargs)
+        except Exception as e:
+            breaker.record_failure()
+            self._report(url, time.time() - start, None, e)
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        self._report(url, time.time() - start, response.status_code, None)
+        return response
+
+    def _report(self, url, seconds, status_code, error):
+        if self.on_request is None:
+            return
+        try:
+            self.on_request(url, seconds, status_code, error)
+        except Exception as e:
+            print(f"HTTP client on_request callback failed: {e}")
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """Breaker state and consecutive failure count per upstream host"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {host: {"state": breaker.state, "failures": breaker.failures} for host, breaker in breakers.items()}
@@ -0,0 +1,56 @@
+import io
+import marshal
+import pstats
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class ProfileStore:
+    """
+    cProfile results of profiled requests, kept in memory until downloaded or evicted.
+
+    add() takes a stopped cProfile.Profile and returns its id; the newest max_entries
+    profiles are kept. data() is the marshalled stats, the same bytes Profile.dump_stats
+    writes, so the download opens with pstats, snakeviz or similar tools.
+    """
+
+    def __init__(self, max_entries=20):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # id -> (created_at, description, profile)
+        self._lock = threading.Lock()
+
+    def add(self, profile, description=''):
+        profile.create_stats()
+        profile_id = uuid.uuid4().hex[:16]
+        with self._lock:
+            self._entries[profile_id] = (time.time(), description, profile)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return profile_id
+
+    def _profile(self, profile_id):
+        with self._lock:
+            entry = self._entries.get(profile_id)
+        return None if entry is None else entry[2]
+
+    def data(self, profile_id):
+        """Marshalled stats (.prof file contents), or None if unknown"""
+        profile = self._profile(profile_id)
+        return None if profile is None else marshal.dumps(profile.stats)
+
+    def text(self, profile_id, sort='cumulative', limit=40):
+        """pstats report of the top `limit` functions, or None if unknown"""
+        profile = self._profile(profile_id)
+        if profile is None:
+            return None
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def list(self):
+        with self._lock:
+            entries = list(self._entries.items())
+        return [{"id": profile_id, "created_at": created_at, "request": description}
+                for profile_id, (created_at, description, _) in reversed(entries)]
@@ -0,0 +1,106 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RoadTileCache:
+    """
+    Road geometry cached per fixed lat/lng tile, so nearby requests share Overpass results.
+
+    fetch_ways(south, west, north, east) must return light way dicts
+    {'id': ..., 'nodes': ((lat, lng), ...), 'tags': {...}} for the bbox. A request only
+    fetches the tiles it is missing (as one query over their bounding rectangle), then
+    merges the cached tiles, deduplicates ways by id and keeps the ways with a node in
+    the requested bbox. Tiles expire after ttl seconds and the least recently used
+    tiles are evicted beyond max_tiles. If fetching fails, expired tiles are served.
+    """
+
+    def __init__(self, fetch_ways, tile_deg=0.01, ttl=86400, max_tiles=4096):
+        self.fetch_ways = fetch_ways
+        self.tile_deg = tile_deg
+        self.ttl = ttl
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()  # (row, col) -> (fetched_at, ways)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _tile_range(self, south, west, north, east):
+        return (int(math.floor(south / self.tile_deg)), int(math.floor(west / self.tile_deg)),
+                int(math.floor(north / self.tile_deg)), int(math.floor(east / self.tile_deg)))
+
+    def _tile_of(self, lat, lng):
+        return int(math.floor(lat / self.tile_deg)), int(math.floor(lng / self.tile_deg))
+
+    def get_ways(self, south, west, north, east):
+        row0, col0, row1, col1 = self._tile_range(south, west, north, east)
+        keys = [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+        now = time.time()
+        cached = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._tiles.get(key)
+                if entry is not None:
+                    self._tiles.move_to_end(key)
+                    cached[key] = entry
+                if entry is None or now - entry[0] >= self.ttl:
+                    missing.append(key)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            try:
+                cached.update(self._fetch_tiles(missing))
+            except Exception:
+                # Serve expired tiles rather than failing, if every missing tile has one
+                if any(key not in cached for key in missing):
+                    raise
+                print(f"Road fetch failed, serving {len(missing)} expired tiles")
+
+        # Merge the tiles, each way once, and keep the ones touching the requested bbox
+        ways = {}
+        for key in keys:
+            for way in cached[key][1]:
+                if way['id'] in ways:
+                    continue
+                if any(south <= lat <= north and west <= lng <= east for lat, lng in way['nodes']):
+                    ways[way['id']] = way
+        return [ways[way_id] for way_id in sorted(ways)]
+
+    def _fetch_tiles(self, missing):
+        """Fetch the bounding rectangle of the missing tiles and cache every tile in it"""
+        row0 = min(row for row, _ in missing)
+        row1 = max(row for row, _ in missing)
+        col0 = min(col for _, col in missing)
+        col1 = max(col for _, col in missing)
+        ways = self.fetch_ways(row0 * self.tile_deg, col0 * self.tile_deg,
+                               (row1 + 1) * self.tile_deg, (col1 + 1) * self.tile_deg)
+
+        # A way belongs to every tile one of its nodes falls in
+        tiles = {(row, col): [] for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)}
+        for way in ways:
+            for key in {self._tile_of(lat, lng) for lat, lng in way['nodes']}:
+                if key in tiles:
+                    tiles[key].append(way)
+
+        fetched_at = time.time()
+        entries = {key: (fetched_at, tile_ways) for key, tile_ways in tiles.items()}
+        with self._lock:
+            for key, entry in entries.items():
+                self._tiles[key] = entry
+                self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return entries
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+    def stats(self):
+        with self._lock:
+            tiles = len(self._tiles)
+        return {"tiles": tiles, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,189 @@
+import re
+import time
+from array import array
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from geo import haversine_np
+from spatial_index import GridIndex, METERS_PER_DEGREE
+
+# Same filter as the Overpass queries: way["highway"]["highway"!~"motorway|motorway_link|trunk|trunk_link"]
+EXCLUDED_HIGHWAY = re.compile(r'motorway|trunk')
+
+# Way tags kept per road (everything else in the extract is dropped)
+KEPT_TAGS = ('name', 'highway')
+
+
+class RoadGraph:
+    """
+    Walkable road network of a local OSM extract, held as flat arrays:
+    - nodes: lats/lngs of every node used by a kept way (node_ids holds the OSM ids)
+    - ways: way_ids, tags and the node indices of each way (way_offsets into way_nodes)
+    - adjacency: undirected edges between consecutive way nodes in CSR form
+      (adj_offsets into adj_targets / adj_lengths in meters / adj_ways)
+    A grid index over the way nodes answers bbox queries without any network access.
+    """
+
+    def __init__(self, node_ids, lats, lngs, way_ids, way_tags, way_offsets, way_nodes, cell_size_m=200):
+        self.node_ids = node_ids
+        self.lats = lats
+        self.lngs = lngs
+        self.way_ids = way_ids
+        self.way_tags = way_tags
+        self.way_offsets = way_offsets
+        self.way_nodes = way_nodes
+        self._build_adjacency()
+
+        # Every way node as an indexed point pointing back to its way
+        self.point_ways = np.repeat(np.arange(len(way_ids), dtype=np.int32), np.diff(way_offsets))
+        self.index = GridIndex(lats[way_nodes], lngs[way_nodes], cell_size_m)
+
+    def _build_adjacency(self):
+        way_of_node = np.repeat(np.arange(len(self.way_ids), dtype=np.int32), np.diff(self.way_offsets))
+        # Consecutive nodes of the same way form an edge
+        same_way = way_of_node[:-1] == way_of_node[1:]
+        src = self.way_nodes[:-1][same_way]
+        dst = self.way_nodes[1:][same_way]
+        ways = way_of_node[:-1][same_way]
+        keep = src != dst
+        src, dst, ways = src[keep], dst[keep], ways[keep]
+        lengths = haversine_np(self.lats[src], self.lngs[src], self.lats[dst], self.lngs[dst])
+
+        # Pedestrians can walk both directions of every road
+        src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+        lengths = np.concatenate([lengths, lengths])
+        ways = np.concatenate([ways, ways])
+        order = np.argsort(src, kind='stable')
+        self.adj_targets = dst[order].astype(np.int32)
+        self.adj_lengths = lengths[order]
+        self.adj_ways = ways[order]
+        self.adj_offsets = np.zeros(len(self.lats) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(self.lats)), out=self.adj_offsets[1:])
+
+    @classmethod
+    def from_osm_xml(cls, path):
+        """
+        Stream an .osm XML extract with iterparse, keeping the highway ways (minus motorways
+        and trunk roads) and the nodes they use. Elements are cleared as soon as they are read.
+        """
+        start = time.time()
+        node_ids = array('q')
+        node_lats = array('d')
+        node_lngs = array('d')
+        way_ids = []
+        way_tags = []
+        way_refs = array('q')
+        way_lengths = []
+
+        context = ET.iterparse(path, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end':
+                continue
+            if elem.tag == 'node':
+                node_ids.append(int(elem.get('id')))
+                node_lats.append(float(elem.get('lat')))
+                node_lngs.append(float(elem.get('lon')))
+            elif elem.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+                highway = tags.get('highway')
+                if highway is not None and not EXCLUDED_HIGHWAY.search(highway):
+                    refs = [int(nd.get('ref')) for nd in elem.iter('nd')]
+                    way_ids.append(int(elem.get('id')))
+                    way_tags.append({key: tags[key] for key in KEPT_TAGS if key in tags})
+                    way_refs.extend(refs)
+                    way_lengths.append(len(refs))
+            else:
+                continue
+            root.clear()
+
+        # Map node references to node positions; refs to nodes missing from the extract
+        # (ways cut at its boundary) are dropped
+        all_ids = np.frombuffer(node_ids, dtype=np.int64)
+        refs = np.frombuffer(way_refs, dtype=np.int64)
+        if len(all_ids):
+            order = np.argsort(all_ids, kind='stable')
+            sorted_ids = all_ids[order]
+            pos = np.minimum(np.searchsorted(sorted_ids, refs), len(sorted_ids) - 1)
+            found = sorted_ids[pos] == refs
+            ref_nodes = order[pos][found]
+        else:
+            found = np.zeros(len(refs), dtype=bool)
+            ref_nodes = np.empty(0, dtype=np.int64)
+
+        way_of_ref = np.repeat(np.arange(len(way_ids)), way_lengths)
+        kept_per_way = np.bincount(way_of_ref[found], minlength=len(way_ids))
+
+        # Only keep nodes that a way uses, renumbered compactly
+        used, way_nodes = np.unique(ref_nodes, return_inverse=True)
+        lats = np.frombuffer(node_lats, dtype=np.float64)[used]
+        lngs = np.frombuffer(node_lngs, dtype=np.float64)[used]
+
+        # Ways with fewer than two known nodes are not roads we can use
+        way_offsets = np.zeros(len(way_ids) + 1, dtype=np.int64)
+        np.cumsum(kept_per_way, out=way_offsets[1:])
+        keep = kept_per_way >= 2
+        if not keep.all():
+            keep_points = np.repeat(keep, kept_per_way)
+            way_nodes = way_nodes[keep_points]
+            way_ids = [way_id for way_id, ok in zip(way_ids, keep) if ok]
+            way_tags = [tags for tags, ok in zip(way_tags, keep) if ok]
+            way_offsets = np.zeros(len(way_ids) + 1, dtype=np.int64)
+            np.cumsum(kept_per_way[keep], out=way_offsets[1:])
+
+        # Ways sorted by id, like Overpass output
+        way_order = np.argsort(np.asarray(way_ids, dtype=np.int64), kind='stable')
+        if len(way_order) and not (np.diff(way_order) > 0).all():
+            starts, ends = way_offsets[:-1][way_order], way_offsets[1:][way_order]
+            way_nodes = np.concatenate([way_nodes[a:b] for a, b in zip(starts, ends)])
+            way_ids = [way_ids[i] for i in way_order]
+            way_tags = [way_tags[i] for i in way_order]
+            way_offsets = np.zeros(len(way_ids) + 1, dtype=np.int64)
+            np.cumsum(ends - starts, out=way_offsets[1:])
+
+        graph = cls(all_ids[used], lats, lngs, np.asarray(way_ids, dtype=np.int64), way_tags, way_offsets,
+                    way_nodes.astype(np.int32))
+        print(f"Loaded road graph from {path}: {len(graph.way_ids)} ways, {len(graph.lats)} nodes, "
+              f"{len(graph.adj_targets) // 2} edges ({time.time() - start:.1f}s)")
+        return graph
+
+    def way(self, way_idx):
+        """Light way dict for one way, same shape as the Overpass road cache returns"""
+        nodes = self.way_nodes[self.way_offsets[way_idx]:self.way_offsets[way_idx + 1]]
+        return {
+            'id': int(self.way_ids[way_idx]),
+            'nodes': tuple(zip(self.lats[nodes].tolist(), self.lngs[nodes].tolist())),
+            'tags': self.way_tags[way_idx]
+        }
+
+    def ways_in_bbox(self, south, west, north, east):
+        """Ways with at least one node inside the bbox, sorted by way id"""
+        idx = self.index.candidates(south, west, north, east)
+        points = self.way_nodes[idx]
+        inside = ((self.lats[points] >= south) & (self.lats[points] <= north) &
+                  (self.lngs[points] >= west) & (self.lngs[points] <= east))
+        way_idx = np.unique(self.point_ways[idx[inside]])
+        return [self.way(i) for i in way_idx.tolist()]
+
+    def neighbors(self, node):
+        """(target nodes, edge lengths in meters, way indices) of the edges leaving a node"""
+        start, end = self.adj_offsets[node], self.adj_offsets[node + 1]
+        return self.adj_targets[start:end], self.adj_lengths[start:end], self.adj_ways[start:end]
+
+    def nearest_node(self, lat, lng, max_distance_m=500):
+        """Index of the closest way node within max_distance_m, or None"""
+        radius_deg = max_distance_m / METERS_PER_DEGREE
+        lng_deg = radius_deg / max(np.cos(np.radians(lat)), 1e-6)
+        idx = self.index.candidates(lat - radius_deg, lng - lng_deg, lat + radius_deg, lng + lng_deg)
+        if len(idx) == 0:
+            return None
+        points = self.way_nodes[idx]
+        distances = haversine_np(lat, lng, self.lats[points], self.lngs[points])
+        best = int(np.argmin(distances))
+        if distances[best] > max_distance_m:
+            return None
+        return int(points[best])
+
+    def __len__(self):
+        return len(self.way_ids)
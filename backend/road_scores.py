@@ -0,0 +1,73 @@
+import json
+import time
+
+import numpy as np
+
+from snapshot import read_snapshot, write_snapshot
+from spatial_index import GridIndex
+
+
+def write_road_scores(path, graph, centers, counts, scores, radius_m, feature_types, meta=None, cell_size_m=200):
+    """
+    Write per-way safety results of a RoadGraph as a snapshot file: way ids, geometry,
+    node-average centers, per-layer counts (ways x feature_types), scores, tags and a grid
+    index over the way nodes so the server can answer bbox queries straight from it.
+    """
+    point_lats = graph.lats[graph.way_nodes]
+    point_lngs = graph.lngs[graph.way_nodes]
+    index = GridIndex(point_lats, point_lngs, cell_size_m)
+    center_lats, center_lngs = centers
+    arrays = {
+        "way_ids": graph.way_ids,
+        "way_offsets": graph.way_offsets,
+        "point_lats": point_lats,
+        "point_lngs": point_lngs,
+        "center_lats": center_lats,
+        "center_lngs": center_lngs,
+        "counts": np.asarray(counts, dtype=np.int32),
+        "scores": np.asarray(scores, dtype=np.float64),
+        "index_order": index.order,
+        "index_keys": index.keys,
+    }
+    blobs = {"tags": json.dumps(graph.way_tags, ensure_ascii=False).encode('utf-8')}
+    meta = dict(meta or {}, radius_m=radius_m, feature_types=list(feature_types), cell_deg=index.cell_deg)
+    write_snapshot(path, arrays, blobs, meta, created_at=time.time())
+
+
+class RoadScores:
+    """Read-only view of a road scores file; arrays stay memory-mapped"""
+
+    def __init__(self, header, arrays, blobs):
+        meta = header["meta"]
+        self.created_at = header.get("created_at")
+        self.radius_m = meta["radius_m"]
+        self.feature_types = tuple(meta["feature_types"])
+        self.way_ids = arrays["way_ids"]
+        self.way_offsets = arrays["way_offsets"]
+        self.point_lats = arrays["point_lats"]
+        self.point_lngs = arrays["point_lngs"]
+        self.center_lats = arrays["center_lats"]
+        self.center_lngs = arrays["center_lngs"]
+        self.counts = arrays["counts"]
+        self.scores = arrays["scores"]
+        self.tags = json.loads(blobs["tags"].decode('utf-8'))
+        self.index = GridIndex.from_arrays(meta["cell_deg"], arrays["index_order"], arrays["index_keys"])
+        self.point_ways = np.repeat(np.arange(len(self.way_ids), dtype=np.int32), np.diff(self.way_offsets))
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(*read_snapshot(path))
+
+    def ways_in_bbox(self, south, west, north, east):
+        """Row indices of the ways with a node inside the bbox, in way id order"""
+        idx = self.index.candidates(south, west, north, east)
+        inside = ((self.point_lats[idx] >= south) & (self.point_lats[idx] <= north) &
+                  (self.point_lngs[idx] >= west) & (self.point_lngs[idx] <= east))
+        return np.unique(self.point_ways[idx[inside]])
+
+    def nodes(self, row):
+        start, end = self.way_offsets[row], self.way_offsets[row + 1]
+        return list(zip(self.point_lats[start:end].tolist(), self.point_lngs[start:end].tolist()))
+
+    def __len__(self):
+        return len(self.way_ids)
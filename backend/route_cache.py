@@ -0,0 +1,18 @@
+from versioned_cache import VersionedCache
+
+
+class RouteCache(VersionedCache):
+    """
+    Results of /find_safe_routes keyed by origin/destination rounded to `precision` decimals
+    (4 decimals is about 11 m) plus the request parameters that change the result, stored
+    against the safety data version they were computed with.
+    """
+
+    def __init__(self, ttl=3600, max_entries=1024, precision=4):
+        super().__init__(ttl, max_entries)
+        self.precision = precision
+
+    def key(self, start_lat, start_lng, end_lat, end_lng, *params):
+        p = self.precision
+        return (round(float(start_lat), p), round(float(start_lng), p),
+                round(float(end_lat), p), round(float(end_lng), p)) + params
@@ -0,0 +1,207 @@
+import heapq
+from array import array
+import math
+import time
+
+import numpy as np
+
+# Average walking speed used for route durations (m/s)
+WALKING_SPEED_MS = 1.3
+
+
+def _dijkstra_all(offsets, targets, costs, source):
+    """Cost from source to every node (math.inf if unreachable)"""
+    dist = [math.inf] * (len(offsets) - 1)
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, v = heapq.heappop(heap)
+        if d > dist[v]:
+            continue
+        for e in range(offsets[v], offsets[v + 1]):
+            w = targets[e]
+            nd = d + costs[e]
+            if nd < dist[w]:
+                dist[w] = nd
+                heapq.heappush(heap, (nd, w))
+    return dist
+
+
+class SafeRouter:
+    """
+    Pedestrian router over a RoadGraph with safety-weighted edge costs.
+
+    Every directed edge costs length * (1 + safety_weight * (100 - safety) / 100), so an edge
+    with safety 0 costs up to (1 + safety_weight) times its length and a fully safe one just
+    its length. Searches are A* with the larger of two lower bounds: the straight line
+    distance and ALT landmark bounds (triangle inequality on the costs from a few landmarks,
+    precomputed with one Dijkstra each). Alternatives come from the penalty method: after
+    each route its edges get more expensive and the search is repeated; penalties only
+    raise costs, so the bounds stay valid.
+    """
+
+    def __init__(self, graph, edge_safety=None, safety_weight=1.0, landmarks=8, version=None):
+        self.graph = graph
+        self.version = version
+        reverse = self._reverse_edges()
+        if edge_safety is None:
+            edge_safety = np.full(len(graph.adj_targets), 100.0)
+        # Both directions of a road cost the same (landmark bounds rely on symmetric costs)
+        edge_safety = np.asarray(edge_safety, dtype=np.float64)
+        edge_safety = (edge_safety + edge_safety[reverse]) / 2
+        self.edge_costs = graph.adj_lengths * (1.0 + safety_weight * (100.0 - edge_safety) / 100.0)
+
+        # Plain lists: per-element access from Python is much faster than on NumPy arrays
+        self._offsets = graph.adj_offsets.tolist()
+        self._targets = graph.adj_targets.tolist()
+        self._costs = self.edge_costs.tolist()
+        self._lats = graph.lats.tolist()
+        self._lngs = graph.lngs.tolist()
+        self._reverse = reverse.tolist()
+
+        # Cost from every landmark to every node, row-major (node * width + landmark)
+        self.landmarks = self._pick_landmarks(landmarks)
+        self._landmark_width = len(self.landmarks)
+        self._landmark_table = None
+        if self.landmarks:
+            start = time.time()
+            tables = [_dijkstra_all(self._offsets, self._targets, self._costs, l) for l in self.landmarks]
+            self._landmark_table = array('d', [d for row in zip(*tables) for d in row])
+            print(f"Routing landmarks ready: {len(self.landmarks)} in {time.time() - start:.1f}s")
+
+    def _pick_landmarks(self, count):
+        """Nodes closest to points spread around the edge of the graph's bounding box"""
+        if count <= 0 or len(self._lats) == 0:
+            return []
+        lats, lngs = self.graph.lats, self.graph.lngs
+        south, north, west, east = lats.min(), lats.max(), lngs.min(), lngs.max()
+        landmarks = []
+        for i in range(count):
+            angle = 2 * math.pi * i / count
+            lat = (south + north) / 2 + (north - south) / 2 * math.sin(angle)
+            lng = (west + east) / 2 + (east - west) / 2 * math.cos(angle)
+            node = int(np.argmin((lats - lat) ** 2 + (lngs - lng) ** 2))
+            if node not in landmarks:
+                landmarks.append(node)
+        return landmarks
+
+    def _reverse_edges(self):
+        """Index of the opposite direction of every edge"""
+        graph = self.graph
+        n = len(graph.lats)
+        src = np.repeat(np.arange(n, dtype=np.int64), np.diff(graph.adj_offsets))
+        dst = graph.adj_targets.astype(np.int64)
+        forward = src * n + dst
+        order = np.argsort(forward, kind='stable')
+        pos = np.searchsorted(forward[order], dst * n + src)
+        return order[np.minimum(pos, len(order) - 1)]
+
+    def _heuristic(self, target):
+        """Return h(v): a lower bound of the cost from v to target"""
+        lats, lngs = self._lats, self._lngs
+        t_lat, t_lng = math.radians(lats[target]), math.radians(lngs[target])
+        cos_t = math.cos(t_lat)
+        table = self._landmark_table
+        if table is not None:
+            # Only landmarks that can reach the target give a bound
+            width = self._landmark_width
+            to_target = [(i, d) for i, d in enumerate(table[target * width:(target + 1) * width]) if d != math.inf]
+            if not to_target:
+                table = None
+
+        def h(v):
+            # Haversine distance (costs are never below the length)
+            lat, lng = math.radians(lats[v]), math.radians(lngs[v])
+            a = math.sin((t_lat - lat) / 2) ** 2 + math.cos(lat) * cos_t * math.sin((t_lng - lng) / 2) ** 2
+            bound = 2 * 6371000 * math.asin(min(1.0, math.sqrt(a))) * 0.999
+            if table is not None:
+                base = v * width
+                for i, d in to_target:
+                    diff = abs(d - table[base + i])
+                    if diff > bound:
+                        bound = diff
+            return bound
+        return h
+
+    def shortest_path(self, source, target, penalties=None):
+        """A* search; returns (list of edge indices, cost) or None if target is unreachable"""
+        h = self._heuristic(target)
+        offsets, targets, costs = self._offsets, self._targets, self._costs
+        penalties = penalties or {}
+        dist = {source: 0.0}
+        parent = {source: -1}
+        closed = set()
+        heap = [(h(source), 0.0, source)]
+        while heap:
+            _, d, v = heapq.heappop(heap)
+            if v == target:
+                break
+            if v in closed or d > dist[v]:
+                continue
+            closed.add(v)
+            for e in range(offsets[v], offsets[v + 1]):
+                w = targets[e]
+                if w in closed:
+                    continue
+                nd = d + costs[e] * penalties.get(e, 1.0)
+                if nd < dist.get(w, math.inf):
+                    dist[w] = nd
+                    parent[w] = e
+                    heapq.heappush(heap, (nd + h(w), nd, w))
+        else:
+            return None
+
+        edges = []
+        v = target
+        while parent[v] != -1:
+            e = parent[v]
+            edges.append(e)
+            v = self._reverse_target(e)
+        edges.reverse()
+        return edges, dist[target]
+
+    def _reverse_target(self, edge):
+        # The source of an edge is the target of its reverse edge
+        return self._targets[self._reverse[edge]]
+
+    def alternatives(self, source, target, k=3, penalty_factor=1.5, max_overlap=0.8, max_tries=None):
+        """
+        Up to k routes, the first being the cheapest. After every search the costs of the
+        route's edges are multiplied by penalty_factor; a route is kept if at most max_overlap
+        of its length is shared with each route kept before it and it is not the same route.
+        """
+        if source == target:
+            return [[]]
+        lengths = self.graph.adj_lengths
+        penalties = {}
+        routes = []
+        kept_edges = []
+        for _ in range(max_tries or k * 3):
+            found = self.shortest_path(source, target, penalties)
+            if found is None:
+                break
+            edges, _ = found
+            undirected = {min(e, self._reverse[e]) for e in edges}
+            length = float(lengths[edges].sum()) if edges else 0.0
+            overlap_ok = all(
+                undirected != other
+                and (length == 0 or float(lengths[list(undirected & other)].sum()) <= max_overlap * length)
+                for other in kept_edges
+            )
+            if overlap_ok:
+                routes.append(edges)
+                kept_edges.append(undirected)
+                if len(routes) >= k:
+                    break
+            for e in edges:
+                for edge in (e, self._reverse[e]):
+                    penalties[edge] = penalties.get(edge, 1.0) * penalty_factor
+        return routes
+
+    def route_geometry(self, source, edges):
+        """[[lat, lng], ...] of a route starting at source"""
+        nodes = [source] + [self._targets[e] for e in edges]
+        return [[self._lats[v], self._lngs[v]] for v in nodes]
+
+    def route_length(self, edges):
+        return float(self.graph.adj_lengths[edges].sum()) if edges else 0.0
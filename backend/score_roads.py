@@ -0,0 +1,110 @@
+"""
+Score every walkable road of a local OSM extract and write the road scores file that
+/get_nearby_roads_safety serves from.
+
+    python score_roads.py --osm taipei.osm [--output snapshot/road_scores.snap] [--radius 200] [--workers 8]
+
+Run it again whenever the safety datasets refresh (e.g. from cron); the server picks up
+the new file within ROAD_SCORES_RELOAD seconds.
+"""
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import backend
+from road_graph import RoadGraph
+from road_scores import write_road_scores
+
+CHUNK_SIZE = 5000  # Ways per worker task
+
+# Safety layers of a worker process, set once by the pool initializer
+_WORKER_LAYERS = None
+
+
+def _init_worker(layers):
+    global _WORKER_LAYERS
+    _WORKER_LAYERS = layers
+
+
+def _count_chunk(task):
+    lats, lngs, radius_m = task
+    return backend.count_features_in_radius_batch(lats, lngs, radius_m, _WORKER_LAYERS)
+
+
+def load_layers(use_snapshot=True):
+    """Safety layers from the server's snapshot if it is fresh, otherwise from the data sources"""
+    if use_snapshot:
+        try:
+            loaded = backend.load_safety_snapshot()
+        except Exception as e:
+            print(f"Failed to load snapshot {backend.SAFETY_SNAPSHOT_PATH}: {e}")
+            loaded = None
+        if loaded is not None:
+            layers, created_at = loaded
+            print(f"Using safety layers from snapshot (age: {int(time.time() - created_at)}s)")
+            return layers
+    return {feature_type: backend.SAFETY_DATASETS[feature_type].get() for feature_type in backend.SAFETY_FEATURE_TYPES}
+
+
+def score_ways(graph, layers, radius_m, workers):
+    """Return ((center lats, center lngs), counts matrix, scores) for every way of the graph"""
+    # Node-average center of every way, as the live endpoint uses
+    sizes = np.diff(graph.way_offsets)
+    starts = graph.way_offsets[:-1]
+    center_lats = np.add.reduceat(graph.lats[graph.way_nodes], starts) / sizes
+    center_lngs = np.add.reduceat(graph.lngs[graph.way_nodes], starts) / sizes
+
+    tasks = [(center_lats[i:i + CHUNK_SIZE], center_lngs[i:i + CHUNK_SIZE], radius_m)
+             for i in range(0, len(center_lats), CHUNK_SIZE)]
+    if workers > 1 and len(tasks) > 1:
+        with Pool(workers, initializer=_init_worker, initargs=(layers,)) as pool:
+            results = pool.map(_count_chunk, tasks)
+    else:
+        _init_worker(layers)
+        results = [_count_chunk(task) for task in tasks]
+    counts = np.vstack(results) if results else np.zeros((0, len(backend.SAFETY_FEATURE_TYPES)), dtype=np.int64)
+
+    scores = [
+        backend.calculate_safety_score(
+            cctv_count=cctv,
+            lamp_count=streetlight,
+            mrt_count=metro,
+            police_count=police,
+            theft_count=0,
+            robbery_count=robbery,
+            store_count=0
+        )
+        for cctv, metro, robbery, streetlight, police in counts.tolist()
+    ]
+    return (center_lats, center_lngs), counts, scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute safety scores for every road of an OSM extract")
+    parser.add_argument('--osm', default=os.environ.get('OSM_EXTRACT_PATH'), help="OSM XML extract (default: $OSM_EXTRACT_PATH)")
+    parser.add_argument('--output', default=os.environ.get('ROAD_SCORES_PATH', 'snapshot/road_scores.snap'))
+    parser.add_argument('--radius', type=int, default=200, help="Safety feature radius in meters")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--no-snapshot', action='store_true', help="Always fetch the datasets instead of using the snapshot")
+    args = parser.parse_args()
+    if not args.osm:
+        parser.error("--osm is required (or set OSM_EXTRACT_PATH)")
+
+    start = time.time()
+    graph = RoadGraph.from_osm_xml(args.osm)
+    layers = load_layers(not args.no_snapshot)
+
+    scoring_start = time.time()
+    centers, counts, scores = score_ways(graph, layers, args.radius, args.workers)
+    print(f"Scored {len(scores)} ways with {args.workers} workers in {time.time() - scoring_start:.1f}s")
+
+    write_road_scores(args.output, graph, centers, counts, scores, args.radius, backend.SAFETY_FEATURE_TYPES,
+                      meta={"osm_path": os.path.abspath(args.osm)})
+    print(f"Wrote {args.output} in {time.time() - start:.1f}s total")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+
+# File layout:
+#   8 bytes   magic
+#   8 bytes   header length (little-endian uint64)
+#   header    UTF-8 JSON: format version, creation time, caller metadata and the
+#             dtype/shape/offset of every array and the offset/length of every blob
+#   sections  raw array data and blobs, each aligned to ALIGNMENT bytes
+# Arrays are memory-mapped on load, so opening a snapshot costs almost nothing.
+MAGIC = b'NKSNAP\x00\x01'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(path, arrays, blobs=None, meta=None, created_at=None):
+    """
+    Write named NumPy arrays and byte blobs to one snapshot file.
+    The file is written next to path and renamed over it, so readers never see a partial snapshot.
+    """
+    blobs = blobs or {}
+    sections = []
+    layout = {"arrays": {}, "blobs": {}}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        sections.append((offset, array.tobytes()))
+        offset = _align(offset + array.nbytes)
+    for name, data in blobs.items():
+        layout["blobs"][name] = {"offset": offset, "length": len(data)}
+        sections.append((offset, data))
+        offset = _align(offset + len(data))
+
+    header = json.dumps({
+        "format_version": FORMAT_VERSION,
+        "created_at": created_at,
+        "meta": meta or {},
+        **layout
+    }).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for section_offset, data in sections:
+                f.seek(data_start + section_offset)
+                f.write(data)
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_snapshot(path):
+    """
+    Open a snapshot written by write_snapshot.
+    Returns (header, arrays, blobs): arrays are read-only memory maps, blobs are bytes.
+    Raises ValueError if the file is not a snapshot of the current format version.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        if header.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version: {header.get('format_version')}")
+        data_start = _align(len(MAGIC) + 8 + header_len)
+
+        blobs = {}
+        for name, info in header["blobs"].items():
+            f.seek(data_start + info["offset"])
+            blobs[name] = f.read(info["length"])
+
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + info["offset"], shape=shape)
+    return header, arrays, blobs
@@ -0,0 +1,55 @@
+import numpy as np
+
+# Roughly how many meters one degree of latitude spans
+METERS_PER_DEGREE = 111320
+
+# Cell keys pack (row, col) into one int64 so cells of a row are contiguous once sorted
+_COL_OFFSET = 1 << 31
+_ROW_STRIDE = 1 << 32
+
+
+class GridIndex:
+    """
+    Fixed-size lat/lng grid over a set of points.
+    Point indices are sorted by cell, so a radius query only has to slice out the
+    few cells its bounding box overlaps (one binary search per grid row) instead
+    of looking at every point.
+    """
+
+    def __init__(self, lats, lngs, cell_size_m=200):
+        self.cell_deg = cell_size_m / METERS_PER_DEGREE
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        keys = self._keys(np.floor(lats / self.cell_deg), np.floor(lngs / self.cell_deg))
+        self.order = np.argsort(keys, kind='stable').astype(np.int32)
+        self.keys = keys[self.order]
+
+    @classmethod
+    def from_arrays(cls, cell_deg, order, keys):
+        """Restore an index saved as its order/keys arrays (e.g. from a snapshot)"""
+        index = cls.__new__(cls)
+        index.cell_deg = cell_deg
+        index.order = order
+        index.keys = keys
+        return index
+
+    @staticmethod
+    def _keys(rows, cols):
+        return rows.astype(np.int64) * _ROW_STRIDE + (cols.astype(np.int64) + _COL_OFFSET)
+
+    def candidates(self, south, west, north, east):
+        """Return indices of all points in cells overlapping the bbox (superset of the exact hits)"""
+        row0 = int(np.floor(south / self.cell_deg))
+        row1 = int(np.floor(north / self.cell_deg))
+        col0 = int(np.floor(west / self.cell_deg))
+        col1 = int(np.floor(east / self.cell_deg))
+        rows = np.arange(row0, row1 + 1)
+        starts = np.searchsorted(self.keys, self._keys(rows, np.full(len(rows), col0)), side='left')
+        ends = np.searchsorted(self.keys, self._keys(rows, np.full(len(rows), col1)), side='right')
+        slices = [self.order[start:end] for start, end in zip(starts, ends) if end > start]
+        if not slices:
+            return np.empty(0, dtype=np.int32)
+        return np.concatenate(slices)
+
+    def __len__(self):
+        return len(self.order)
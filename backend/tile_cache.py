@@ -0,0 +1,21 @@
+import hashlib
+
+
+class Tile:
+    """
+    A rendered /tiles body with its ETag and the compressed copies made so far. Tiles are
+    cached in a VersionedCache keyed by (z, x, y) plus the request parameters that change
+    them, so a dataset refresh invalidates every tile.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.encoded = {}  # content coding -> compressed body
+
+    def encode(self, coding, compress):
+        """Body compressed with compress() for `coding`, computed once per tile"""
+        data = self.encoded.get(coding)
+        if data is None:
+            data = self.encoded[coding] = compress(self.body)
+        return data
@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionedCache:
+    """
+    In-memory LRU cache whose entries remember the version of the data they were computed
+    from; a lookup with a different version is a miss and drops the entry, so refreshed
+    datasets are never served from old results. Entries expire after ttl seconds and the
+    least recently used ones are evicted beyond max_entries (0 disables caching).
+    """
+
+    def __init__(self, ttl=3600, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (stored_at, version, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (now - entry[0] >= self.ttl or entry[1] != version):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, version):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }